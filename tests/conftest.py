@@ -13,6 +13,8 @@ from trees import trees, treeinput
 
 @pytest.fixture(scope='function',
                 params=[(treeinput.tigerxml, testdata.SAMPLE_TIGERXML, {}),
+                        (treeinput.tigerxml, testdata.SAMPLE_TIGERXML,
+                         {'tigerxml_stream' : True}),
                         (treeinput.export, testdata.SAMPLE_EXPORT, {})])
 def discont_tree(request):
     """Load discontinuous tree samples
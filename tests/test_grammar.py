@@ -8,7 +8,8 @@ Author: Wolfgang Maier <maierw@hhu.de>
 import pytest
 import io
 import os
-from trees import grammar, grammaroutput, grammarinput, grammarconst
+from trees import grammar, grammaroutput, grammarinput, grammarconst, \
+    treearray
 from . import testdata
 
 
@@ -145,6 +146,40 @@ def test_input_rcg(discont_grammar_novert, discont_lex):
         os.remove("tempdest.%s" % ending)
 
 
+def test_extract_array(discont_tree, cont_tree):
+    """Test grammar extraction from tree arrays
+    """
+    pytest.importorskip('numpy')
+    gram = {}
+    lex = {}
+    for tree in [discont_tree, cont_tree]:
+        grammar.extract(tree, gram, lex)
+    arr_gram = {}
+    arr_lex = {}
+    grammar.extract(treearray.from_trees([discont_tree, cont_tree]),
+                    arr_gram, arr_lex)
+    assert arr_gram == gram
+    assert arr_lex == lex
+
+
+def test_merge(discont_tree, cont_tree):
+    """Test merging of grammars extracted separately
+    """
+    gram = {}
+    lex = {}
+    for tree in [discont_tree, cont_tree, cont_tree]:
+        grammar.extract(tree, gram, lex)
+    merged_gram = {}
+    merged_lex = {}
+    for trees in [[discont_tree], [cont_tree, cont_tree]]:
+        part_gram = {}
+        part_lex = {}
+        for tree in trees:
+            grammar.extract(tree, part_gram, part_lex)
+        grammar.merge(merged_gram, merged_lex, part_gram, part_lex)
+    assert merged_gram == gram
+    assert merged_lex == lex
+
 @pytest.fixture(scope='function')
 def cont_grammar(cont_tree):
     gram = {}
@@ -5,11 +5,17 @@ Unit tests (pytest) for tree operations
 
 Author: Wolfgang Maier <maierw@hhu.de>
 """
+import argparse
 import pytest
 import tempfile
+import bz2
+import gzip
+import io
+import os
 import sys
 from StringIO import StringIO
-from trees import trees, treeinput, treeoutput, transform, treeanalysis
+from trees import trees, treeinput, treeoutput, transform, treeanalysis, \
+    treearray, treeindex, treecache, misc
 from . import testdata
 
 
@@ -76,6 +82,113 @@ def test_labels(cont_tree):
     assert cont_tree_labels_new == cont_tree_labels_goal
 
 
+def test_label_cache():
+    """Parsed labels are cached and immutable, gf separator is honored
+    """
+    e = trees.parse_label("NP-SBJ-1")
+    assert trees.parse_label("NP-SBJ-1") is e
+    with pytest.raises(AttributeError):
+        e.coindex = ""
+    e = e._replace(coindex="")
+    assert trees.format_label(e) == "NP-SBJ"
+    e = trees.parse_label("NP#SBJ-1", gf_separator="#")
+    assert e.label == "NP"
+    assert e.gf == "SBJ"
+    assert e.coindex == "1"
+    assert trees.format_label(e) == "NP#SBJ-1"
+
+
+def test_memoize():
+    """misc.memoize, bounded number of results
+    """
+    calls = []
+    @misc.memoize(maxsize=2)
+    def square(number):
+        calls.append(number)
+        return number * number
+    assert [square(i) for i in [1, 2, 1, 2]] == [1, 4, 1, 4]
+    assert calls == [1, 2]
+    # the cache is full, it is emptied
+    assert square(3) == 9
+    assert square(1) == 1
+    assert calls == [1, 2, 3, 1]
+
+
+def test_node_data(discont_tree):
+    """trees.NodeData and node construction
+    """
+    data = trees.NodeData(trees.make_node_data())
+    assert data == trees.make_node_data()
+    assert not 'num' in data
+    assert data.get('num') is None
+    data['num'] = 3
+    data['head'] = True
+    assert 'num' in data and 'head' in data
+    assert data['num'] == 3
+    assert data.extra == {'head' : True}
+    del data['num']
+    with pytest.raises(KeyError):
+        data['num']
+    with pytest.raises(KeyError):
+        data['split']
+    tree = trees.Tree(data)
+    assert tree.data == data
+    assert not tree.data is data
+    tree.data['head'] = False
+    assert data['head']
+    assert trees.Tree().data == trees.make_node_data()
+    for node in trees.preorder(discont_tree):
+        assert isinstance(node.data, trees.NodeData)
+
+
+def test_clone(discont_tree):
+    """trees.clone, copy-on-write node data
+    """
+    discont_tree.data['head'] = True
+    copy = trees.clone(discont_tree)
+    assert copy.data.extra is discont_tree.data.extra
+    original = [(node.data.items(), depth) for node, depth
+                in trees.preorder_with_depth(discont_tree)]
+    assert [(node.data.items(), depth) for node, depth
+            in trees.preorder_with_depth(copy)] == original
+    assert not set(trees.preorder(copy)) & set(trees.preorder(discont_tree))
+    copy.data['head'] = False
+    transform.root_attach(copy)
+    trees.delete_terminals(copy, trees.terminals(copy)[:2])
+    assert discont_tree.data['head']
+    assert [(node.data.items(), depth) for node, depth
+            in trees.preorder_with_depth(discont_tree)] == original
+    assert trees.span(copy) != trees.span(discont_tree)
+
+
+def test_symbols(discont_tree, tmpdir):
+    """trees.SymbolTable, interning in the readers
+    """
+    table = trees.SymbolTable()
+    label = u"".join([u"N", u"N"])
+    assert table.id(label) == 0
+    assert table.id(u"NE") == 1
+    assert table.intern(u"NN") is label
+    assert table[1] == u"NE"
+    assert len(table) == 2 and u"NE" in table
+    labels = {}
+    for node in trees.preorder(discont_tree):
+        label = node.data['label']
+        assert labels.setdefault(label, label) is label
+    table = trees.symbol_table()
+    assert trees.DEFAULT_EDGE in table and trees.DEFAULT_ROOT in table
+    sample = tmpdir.join("sample.export")
+    sample.write(testdata.SAMPLE_EXPORT)
+    tree = next(treeinput.export(str(sample), 'utf8', quiet=True,
+                                 symbols=table))
+    for node in trees.preorder(tree):
+        assert table.intern(node.data['label']) is node.data['label']
+        assert table.intern(node.data['edge']) is node.data['edge']
+    size = len(table)
+    next(treeinput.export(str(sample), 'utf8', quiet=True))
+    assert len(table) == size
+
+
 def test_cont_general(cont_tree):
     """General tests concerning continuous trees.
     """
@@ -156,6 +269,462 @@ def test_cont_output(cont_tree):
     assert result == original
 
 
+def test_formatters(discont_tree):
+    """treeoutput.formatters, output functions specialized for options
+    """
+    params = {'gf' : True, 'gf_separator' : '#', 'export_four' : True}
+    assert treeoutput.formatters(**params) \
+        is treeoutput.formatters(**dict(params))
+    get_label = treeoutput.formatters(**params).label
+    for node in trees.preorder(discont_tree):
+        node.data['edge'] = u"SB"
+        assert get_label(node) == trees.get_label(node, **params)
+        expected = node.data['label']
+        if trees.has_children(node):
+            expected += u"#SB"
+        assert get_label(node) == expected
+    assert treeoutput.formatters().label(discont_tree) == u"VROOT"
+    treeoutput.compute_export_numbering(discont_tree)
+    terminal = trees.terminals(discont_tree)[0]
+    assert treeoutput.formatters(**params).export_line(terminal).split() \
+        == [u"Who", u"--", u"WP", u"--", u"SB", u"500"]
+
+
+def test_bracket_lexer():
+    """treeinput.bracket_lexer with tokens across block boundaries
+    """
+    text = u"(S (NP Das)\n\t(VP ist))"
+    expected = [(u"(", "LRB"), (u"S", "TOKEN"), (u" ", "WS"), (u"(", "LRB"),
+                (u"NP", "TOKEN"), (u" ", "WS"), (u"Das", "TOKEN"),
+                (u")", "RRB"), (u"\n\t", "WS"), (u"(", "LRB"),
+                (u"VP", "TOKEN"), (u" ", "WS"), (u"ist", "TOKEN"),
+                (u")", "RRB"), (u")", "RRB")]
+    for block_size in [1, 2, 5, 1024]:
+        lexer = treeinput.bracket_lexer(StringIO(text), block_size)
+        assert list(lexer) == expected
+
+
+def test_bracket_lines(tmpdir):
+    """treeinput.brackets with brackets_lines and brackets_jobs
+    """
+    lines = [testdata.SAMPLE_BRACKETS.replace("\n", " ").strip(),
+             testdata.SAMPLE_BRACKETS_TOL.replace("\n", "").strip()]
+    # trees deeper than the recursion limit of pickle
+    deep = "(" + "(X " * 600 + "(NN a)" + ")" * 601
+    name = str(tmpdir.join("sample.brackets"))
+    with open(name, 'w') as stream:
+        stream.write("\n".join(lines * 1500 + [deep] * 3) + "\n")
+    params = {'brackets_emptypos': True, 'quiet': True}
+    expected = [(tree.data['sid'], [(node.data['label'],
+                                     node.data.get('word'))
+                                    for node in trees.preorder(tree)])
+                for tree in treeinput.brackets(name, 'utf8', **params)]
+    assert len(expected) == 3003
+    for option in [{'brackets_lines': True}, {'brackets_jobs': 2}]:
+        option.update(params)
+        result = [(tree.data['sid'], [(node.data['label'],
+                                       node.data.get('word'))
+                                      for node in trees.preorder(tree)])
+                  for tree in treeinput.brackets(name, 'utf8', **option)]
+        assert result == expected
+    with pytest.raises(ValueError):
+        treeinput.bracket_parse_line(u"(S (NN a)")
+
+
+def test_export_build_sentence():
+    """treeinput.export_build_sentence
+    """
+    lines = [line.strip() for line
+             in testdata.SAMPLE_EXPORT.strip().split('\n')[1:-1]]
+    tree = treeinput.export_build_sentence(lines)
+    assert [node.data['label'] for node in trees.preorder(tree)] \
+        == testdata.DISCONT_LABELS_PREORDER
+    for node in trees.preorder(tree):
+        assert not 'terminals' in node.data
+        assert node.children == trees.children(node)
+    with pytest.raises(ValueError):
+        treeinput.export_build_sentence(lines[:-1])
+
+
+def test_export_parallel(tmpdir):
+    """treeinput.export with several processes, also of deep trees
+    """
+    content = "".join([testdata.SAMPLE_EXPORT.replace(" 1\n", " %d\n" % i)
+                       for i in range(1, 30)]
+                      + [testdata.deep_export(i) for i in range(30, 33)])
+    name = str(tmpdir.join("sample.export"))
+    with open(name, 'w') as stream:
+        stream.write(content)
+    shards = treeinput.export_shards(name, 8)
+    assert shards[0][0] == 0 and shards[-1][1] == len(content)
+    assert all([content[start:].startswith("#BOS")
+                for start, _ in shards])
+    expected = [(tree.data['sid'], [node.data['label'] for node
+                                    in trees.preorder(tree)])
+                for tree in treeinput.export(name, 'utf8')]
+    result = [(tree.data['sid'], [node.data['label'] for node
+                                  in trees.preorder(tree)])
+              for tree in treeinput.export(name, 'utf8', export_jobs=2)]
+    assert result == expected
+    result = treeinput.export(name, 'utf8', export_jobs=2,
+                              export_unordered=True)
+    assert sorted([tree.data['sid'] for tree in result]) \
+        == list(range(1, 33))
+
+
+def test_input_files(tmpdir):
+    """treeinput.input_files, analysis of several files
+    """
+    directory = str(tmpdir)
+    for i in range(1, 4):
+        with open(os.path.join(directory, "%d.export" % i), 'w') as stream:
+            stream.write(testdata.SAMPLE_EXPORT * i)
+    open(os.path.join(directory, "1.export.idx"), 'w').close()
+    names = [os.path.join(directory, "%d.export" % i) for i in [3, 2, 1]]
+    assert treeinput.input_files(directory) == names
+    assert treeinput.input_files(os.path.join(directory, "*.export")) \
+        == names
+    assert treeinput.input_files(names[0]) == [names[0]]
+    result = treeanalysis.SentenceCount()
+    for name in names:
+        count = treeanalysis.SentenceCount()
+        for record in treeinput.records(name, 'utf8', 'export'):
+            count.run(record)
+        result.merge(count)
+    assert result.cnt == 6
+    assert result.token_cnt == 6 * len(testdata.WORDS)
+
+
+@pytest.mark.parametrize("in_format,opts", [('export', 'export_jobs:2'),
+                                            ('brackets', 'brackets_jobs:2')])
+def test_transform_jobs(in_format, opts, tmpdir):
+    """transform with --jobs and a reader starting its own processes
+    """
+    directory = str(tmpdir)
+    if in_format == 'export':
+        sample = "".join([testdata.SAMPLE_EXPORT.replace(" 1\n", " %d\n" % i)
+                          for i in range(1, 11)])
+    else:
+        sample = (testdata.SAMPLE_BRACKETS.strip().replace("\n", " ")
+                  + "\n") * 10
+    names = []
+    for i in range(1, 3):
+        names.append(os.path.join(directory, "%d.%s" % (i, in_format)))
+        with open(names[-1], 'w') as stream:
+            stream.write(sample)
+    parser = argparse.ArgumentParser()
+    transform.add_parser(parser.add_subparsers())
+    args = parser.parse_args(['transform', directory, 'unused',
+                              '--src-format', in_format,
+                              '--dest-format', 'export', '--jobs', '2',
+                              '--src-opts', 'quiet', opts])
+    args.func(args)
+    for name in names:
+        assert [tree.data['sid'] for tree in
+                treeinput.export("%s.dest" % name, 'utf8')] \
+            == list(range(1, 11))
+
+
+def test_split(tmpdir):
+    """transform with --split, streaming the trees into the parts
+    """
+    src = str(tmpdir.join("src.export"))
+    dest = str(tmpdir.join("dest"))
+    with open(src, 'w') as stream:
+        stream.write("".join([testdata.SAMPLE_EXPORT.replace(" 1\n",
+                                                             " %d\n" % i)
+                              for i in range(1, 11)]))
+    assert treeinput.count_sentences(src, 'utf8', 'export') == 10
+    parser = argparse.ArgumentParser()
+    transform.add_parser(parser.add_subparsers())
+    args = parser.parse_args(['transform', src, dest, '--split',
+                              '30%_rest_1#', '--dest-format', 'tigerxml',
+                              '--src-opts', 'quiet', '--write-jobs', '2'])
+    args.func(args)
+    sids = [[tree.data['sid'] for tree in
+             treeinput.tigerxml("%s.%d" % (dest, i), 'utf8', quiet=True)]
+            for i in range(3)]
+    assert sids == [[1, 2, 3], [4, 5, 6, 7, 8, 9], [10]]
+    assert [treeinput.count_sentences("%s.%d" % (dest, i), 'utf8',
+                                      'tigerxml')
+            for i in range(3)] == [3, 6, 1]
+
+
+@pytest.mark.parametrize("in_format,sample",
+                         [('export', testdata.SAMPLE_EXPORT),
+                          ('tigerxml', testdata.SAMPLE_TIGERXML_TWO),
+                          ('brackets', testdata.SAMPLE_BRACKETS * 2),
+                          ('discobrackets', "(S (A 1) (B 0))\tx (\n"
+                           "(S (A 0))\ty\n")])
+def test_records(in_format, sample, tmpdir):
+    """treeinput.records, lazy trees
+    """
+    name = str(tmpdir.join("sample"))
+    with open(name, 'w') as stream:
+        stream.write(sample)
+    expected = list(getattr(treeinput, in_format)(name, 'utf8', quiet=True))
+    result = list(treeinput.records(name, 'utf8', in_format, quiet=True))
+    assert [record.sid for record in result] \
+        == [tree.data['sid'] for tree in expected]
+    assert [record.token_count for record in result] \
+        == [len(trees.terminals(tree)) for tree in expected]
+    assert all([record._tree is None for record in result])
+    for record, tree in zip(result, expected):
+        assert record.tree is record.tree
+        assert record.tree.data['sid'] == record.sid
+        assert [(node.data['label'], node.data.get('word'))
+                for node in trees.preorder(record.tree)] \
+            == [(node.data['label'], node.data.get('word'))
+                for node in trees.preorder(tree)]
+
+
+@pytest.mark.parametrize("in_format,sample",
+                         [('export', testdata.SAMPLE_EXPORT),
+                          ('tigerxml', testdata.SAMPLE_TIGERXML)])
+def test_treecache(in_format, sample, tmpdir):
+    """treecache, reading with the cache option
+    """
+    name = str(tmpdir.join("sample"))
+    with open(name, 'w') as stream:
+        stream.write(sample)
+    reader = getattr(treeinput, in_format)
+    path = treecache.cache_file(in_format, name, 'utf8', {})
+    expected = [tree.data.items() for tree in reader(name, 'utf8')
+                for tree in trees.preorder(tree)]
+    result = list(reader(name, 'utf8', cache=True, quiet=True))
+    assert os.path.exists(path)
+    assert path != treecache.cache_file(in_format, name, 'utf8',
+                                        {'continuous' : True})
+    assert path == treecache.cache_file(in_format, name, 'utf8',
+                                        {'export_jobs' : 2,
+                                         'tigerxml_stream' : True})
+    assert [tree.data.items() for tree in result
+            for tree in trees.preorder(tree)] == expected
+    table = trees.SymbolTable()
+    result = list(reader(name, 'utf8', cache=True, quiet=True,
+                         symbols=table))
+    assert [tree.data.items() for tree in result
+            for tree in trees.preorder(tree)] == expected
+    for node in trees.preorder(result[0]):
+        assert node.data['label'] is table.intern(node.data['label'])
+    assert [node.data['word'] for node in trees.terminals(result[0])] \
+        == testdata.WORDS
+
+
+@pytest.mark.parametrize("suffix", ['.gz', '.bz2'])
+def test_compressed_input(suffix, tmpdir):
+    """Reading compressed treebanks
+    """
+    opener = {'.gz' : gzip.open, '.bz2' : bz2.BZ2File}[suffix]
+    name = str(tmpdir.join("sample" + suffix))
+    for reader, sample in [(treeinput.export, testdata.SAMPLE_EXPORT),
+                           (treeinput.tigerxml, testdata.SAMPLE_TIGERXML),
+                           (treeinput.brackets, testdata.SAMPLE_BRACKETS)]:
+        compressed = opener(name, 'wb')
+        compressed.write(sample * 2 if reader == treeinput.brackets
+                         else sample)
+        compressed.close()
+        result = list(reader(name, 'utf8', quiet=True))
+        assert len(result) == (2 if reader == treeinput.brackets else 1)
+        words = [node.data['word'] for node in trees.terminals(result[0])]
+        assert words == testdata.WORDS
+
+
+def test_buffered_output(discont_tree, tmpdir):
+    """misc.open_output, writing trees in encoded chunks
+    """
+    expected = StringIO()
+    treeoutput.export(discont_tree, expected)
+    name = str(tmpdir.join("output.export"))
+    with misc.open_output(name, 'utf-16', buffer_size=100) as stream:
+        for _ in range(3):
+            treeoutput.export(discont_tree, stream)
+            assert stream.size == 0
+        stream.write(u"x")
+    with io.open(name, encoding='utf-16') as stream:
+        assert stream.read() == expected.getvalue() * 3 + u"x"
+
+
+@pytest.mark.parametrize("out_format", ['export', 'tigerxml'])
+def test_write_trees(out_format, monkeypatch, tmpdir):
+    """treeoutput.write_trees, rendering in worker processes, also of
+    deep trees
+    """
+    monkeypatch.setattr(treeoutput, 'WRITE_BATCH_SIZE', 3)
+    tree_list = []
+    for i in range(1, 21):
+        tree = treeinput.export_build_sentence(
+            [line.strip() for line
+             in testdata.SAMPLE_EXPORT.strip().split('\n')[1:-1]])
+        tree.data['sid'] = i
+        tree_list.append(tree)
+    for i in range(21, 24):
+        tree = treeinput.export_build_sentence(
+            testdata.deep_export(i).strip().split('\n')[1:-1])
+        tree.data['sid'] = i
+        tree_list.append(tree)
+    # rendered by the calling process
+    tree_list[4].data['origin'] = object()
+    name = str(tmpdir.join("output"))
+    results = []
+    for jobs in [1, 2]:
+        with misc.open_output(name, 'utf-16') as stream:
+            assert treeoutput.write_trees(iter(tree_list), out_format,
+                                          stream, jobs) == 23
+        with io.open(name, encoding='utf-16') as stream:
+            results.append(stream.read())
+    assert results[0] == results[1]
+    assert results[0].count(u"Manfred") == 20
+
+
+@pytest.mark.parametrize("in_format", ['export', 'tigerxml', 'brackets'])
+def test_treeindex(in_format, tmpdir):
+    """treeindex.TreeIndex, random access by sentence id
+    """
+    if in_format == 'export':
+        sample = testdata.SAMPLE_EXPORT
+        second = sample.replace("#BOS 1", "#BOS 7").replace("#EOS 1", "#EOS 7")
+        content = sample + second.replace("Fritz", "Franz")
+    elif in_format == 'tigerxml':
+        sample = testdata.SAMPLE_TIGERXML
+        start = sample.index("<s id")
+        end = sample.index("</s>") + len("</s>")
+        second = sample[start:end].replace('<s id="1"', '<s id="s7"')
+        content = sample[:end] + "\n" + second.replace("Fritz", "Franz") \
+            + sample[end:]
+    else:
+        sample = testdata.SAMPLE_BRACKETS
+        content = sample + sample.replace("Fritz", "Franz")
+    name = str(tmpdir.join("sample"))
+    with open(name, 'w') as stream:
+        stream.write(content)
+    reader = getattr(treeinput, in_format)
+    expected = list(reader(name, 'utf8', quiet=True))
+    index = treeindex.TreeIndex(name, 'utf8', in_format)
+    assert os.path.exists(name + treeindex.INDEX_SUFFIX)
+    assert len(index) == 2
+    assert index.sids == [tree.data['sid'] for tree in expected]
+    for tree in [index.tree(index.sids[1])] \
+            + list(index.range(0, index.sids[0])):
+        original = expected[index.sids.index(tree.data['sid'])]
+        assert [(node.data['label'], node.data.get('word'))
+                for node in trees.preorder(tree)] \
+            == [(node.data['label'], node.data.get('word'))
+                for node in trees.preorder(original)]
+    assert treeindex.load_index(name, in_format) \
+        == treeindex.build_index(name, in_format)
+    with open(name, 'a') as stream:
+        stream.write("\n")
+    with open(name + treeindex.INDEX_SUFFIX, 'a') as stream:
+        stream.write("0 0 0\n")
+    assert len(treeindex.TreeIndex(name, 'utf8', in_format)) == 2
+
+
+def test_ordering_cache(cont_tree):
+    """Cached children and terminal orderings, trees.add_child,
+    trees.remove_child, trees.move_subtree, assignment of data['num']
+    """
+    tree = cont_tree
+    assert trees.children(tree) is not trees.children(tree)
+    assert trees.terminal_bounds(tree) == (1, 9)
+    s_node = trees.children(tree)[0]
+    assert s_node.data['label'] == 'S'
+    terms = trees.terminals(tree)
+    # moving the question mark below the root reorders nothing
+    trees.move_subtree(terms[-1], tree)
+    assert [child.data['label'] for child in trees.children(tree)] \
+        == ['S', '?']
+    assert trees.terminal_bounds(s_node) == (1, 8)
+    # renumbering terminals changes the order
+    for term in terms:
+        trees.set_num(term, len(terms) + 1 - term.data['num'])
+    assert [child.data['label'] for child in trees.children(tree)] \
+        == ['?', 'S']
+    assert [term.data['word'] for term in trees.terminals(tree)] \
+        == testdata.WORDS[::-1]
+    # numbers of non-terminals do not affect the caches
+    cache = s_node._cache
+    treeoutput.compute_export_numbering(tree)
+    assert s_node._cache is cache
+    # assigning numbers directly invalidates the caches as well
+    for term in terms:
+        term.data['num'] = len(terms) + 1 - term.data['num']
+    assert [term.data['word'] for term in trees.terminals(tree)] \
+        == testdata.WORDS
+    assert [child.data['label'] for child in trees.children(tree)] \
+        == ['S', '?']
+    terms[0].data['num'], terms[1].data['num'] = 2, 1
+    assert [term.data['num'] for term in trees.terminals(tree)] \
+        == list(range(1, len(terms) + 1))
+    assert trees.terminals(tree)[:2] == [terms[1], terms[0]]
+    assert trees.terminal_bounds(s_node) == (1, 8)
+    terms[0].data['num'], terms[1].data['num'] = 1, 2
+    assert trees.terminals(tree)[0] is terms[0]
+    # also with reassigned node data
+    terms[0].data = trees.NodeData(terms[0].data)
+    terms[0].data['num'] = 100
+    assert trees.terminals(tree)[-1] is terms[0]
+    terms[0].data = dict(terms[0].data.items(), num=1)
+    assert isinstance(terms[0].data, trees.NodeData)
+    assert trees.terminals(tree)[0] is terms[0]
+    terms[1].data = terms[0].data
+    assert not terms[1].data is terms[0].data
+    terms[1].data['num'] = 2
+    assert trees.terminals(tree)[:2] == terms[:2]
+    trees.remove_child(tree, terms[-1])
+    assert terms[-1].parent is None
+    assert trees.children(tree) == [s_node]
+    with pytest.raises(ValueError):
+        trees.add_child(s_node, terms[0])
+    trees.add_child(tree, terms[-1])
+    assert len(trees.terminals(tree)) == len(terms)
+
+
+def test_traversals(cont_tree):
+    """trees.preorder, trees.postorder, trees.levelorder and their
+    variants with depth, also on very deep trees
+    """
+    labels = [node.data['label'] for node in trees.levelorder(cont_tree)]
+    assert labels[:4] == [u'VROOT', u'S', u'?', u'WP']
+    assert labels[-1] == u'VB'
+    assert sorted(labels) == sorted(testdata.CONT_LABELS_PREORDER)
+    depths = [depth for _, depth in trees.preorder_with_depth(cont_tree)]
+    assert depths[:4] == [0, 1, 2, 2]
+    assert [node for node, _ in trees.preorder_with_depth(cont_tree)] \
+        == list(trees.preorder(cont_tree))
+    assert [node for node, _ in trees.postorder_with_depth(cont_tree)] \
+        == list(trees.postorder(cont_tree))
+    assert list(trees.postorder(cont_tree))[-1] == cont_tree
+    assert sorted([depth for _, depth in
+                   trees.levelorder_with_depth(cont_tree)]) == sorted(depths)
+    # right-branching tree deeper than the recursion limit
+    depth = sys.getrecursionlimit() + 100
+    root = trees.Tree(trees.make_node_data_fill())
+    root.data['label'] = trees.DEFAULT_ROOT
+    node = root
+    for i in range(1, depth + 1):
+        term = trees.Tree(trees.make_node_data_fill())
+        term.data['word'] = u"w%d" % i
+        term.data['num'] = i
+        phrase = trees.Tree(trees.make_node_data_fill())
+        phrase.data['label'] = u"X"
+        trees.add_child(node, term)
+        trees.add_child(node, phrase)
+        node = phrase
+    term = trees.Tree(trees.make_node_data_fill())
+    term.data['num'] = depth + 1
+    trees.add_child(node, term)
+    assert len(list(trees.preorder(root))) == 2 * depth + 2
+    assert len(list(trees.postorder(root))) == 2 * depth + 2
+    assert len(trees.terminals(root)) == depth + 1
+    assert len(trees.unordered_terminals(root)) == depth + 1
+    stream = StringIO()
+    treeoutput.write_brackets_subtree(root, stream)
+    assert stream.getvalue().count(u"(") == 2 * depth + 2
+    root = transform.binarize(root)
+    assert len(trees.terminals(root)) == depth + 1
+
+
 def test_delete_terminal(discont_tree, cont_tree):
     """trees.delete_terminal
     """
@@ -183,6 +752,21 @@ def test_delete_terminal(discont_tree, cont_tree):
     assert res_num_nodes == old_num_nodes - 1
 
 
+def test_delete_terminals(discont_tree):
+    """trees.delete_terminals
+    """
+    old_num_nodes = len([node for node in trees.preorder(discont_tree)])
+    terminals = trees.terminals(discont_tree)
+    result = trees.delete_terminals(terminals[3], [terminals[0], terminals[2]])
+    res_words = [node.data['word'] for node in trees.terminals(discont_tree)]
+    res_nums = [node.data['num'] for node in trees.terminals(discont_tree)]
+    res_num_nodes = len([node for node in trees.preorder(discont_tree)])
+    assert result == discont_tree
+    assert res_words == testdata.WORDS[1:2] + testdata.WORDS[3:]
+    assert res_nums == list(range(1, len(testdata.WORDS) - 1))
+    assert res_num_nodes == old_num_nodes - 2
+
+
 def test_lca(discont_tree, cont_tree):
     """trees.lca
     """
@@ -204,6 +788,24 @@ def test_lca(discont_tree, cont_tree):
     assert croot_children[0] == clca
 
 
+def test_lca_index(discont_tree, cont_tree):
+    """trees.LcaIndex
+    """
+    for tree in [discont_tree, cont_tree]:
+        index = trees.LcaIndex(tree)
+        terms = trees.terminals(tree)
+        for term_a in terms:
+            for term_b in terms:
+                if not term_a == term_b:
+                    assert index.lca(term_a, term_b) \
+                        == trees.lca(term_a, term_b)
+        nodes = list(trees.preorder(tree))
+        assert index.lca(nodes[1], terms[0]) == nodes[1]
+        assert index.lca(terms[0], terms[0]) == terms[0]
+        assert index.lca(tree, terms[-1]) == tree
+        assert index.lca(terms[0], trees.Tree()) is None
+
+
 def test_right_sibling(discont_tree, cont_tree):
     """trees.right_sibling
     """
@@ -267,6 +869,28 @@ def test_terminal_blocks(discont_tree, cont_tree):
             break
 
 
+def test_spans(discont_tree, cont_tree):
+    """trees.span, trees.is_continuous, trees.blocks, trees.gap_degree
+    """
+    for node in trees.preorder(discont_tree):
+        nums = [term.data['num'] for term in trees.terminals(node)]
+        assert trees.span(node) == sum([1 << num for num in nums])
+        if node.data['label'] == 'VP':
+            assert trees.blocks(node) == [(1, 1), (4, 8)]
+            assert not trees.is_continuous(node)
+            assert trees.gap_degree(node) == 1
+            break
+    assert trees.blocks(discont_tree) == [(1, 9)]
+    assert trees.is_continuous(discont_tree)
+    for node in trees.preorder(cont_tree):
+        assert trees.is_continuous(node)
+        assert trees.gap_degree(node) == 0
+    terms = trees.terminals(cont_tree)
+    trees.set_num(terms[0], 12)
+    assert trees.blocks(cont_tree) == [(2, 9), (12, 12)]
+    assert trees.gap_degree(cont_tree) == 1
+
+
 def test_dominance(discont_tree, cont_tree):
     """trees.dominance
     """
@@ -527,6 +1151,29 @@ def test_ptb_delete_traces(cont_tree):
     terms[-2].data['label'] = "-NONE-"
     cont_tree = transform.ptb_delete_traces(cont_tree)
     assert len(trees.terminals(cont_tree)) == len(terms) - 1
+    # a sentence consisting only of traces is left empty
+    tree = next(treeinput.bracket_parser(StringIO(u"((S (-NONE- *T*-1)))"),
+                                         quiet=True))
+    tree = transform.ptb_delete_traces(tree)
+    assert tree.children == []
+    stream = StringIO()
+    treeoutput.export(tree, stream)
+    assert stream.getvalue() == u"#BOS 1\n#EOS 1\n"
+
+
+def test_punctuation_delete():
+    """transform.punctuation_delete
+    """
+    tree = next(treeinput.bracket_parser(StringIO(u"(S (NN a) ($. .))"),
+                                         quiet=True))
+    tree = transform.punctuation_delete(tree, quiet=True)
+    assert [term.data['word'] for term in trees.terminals(tree)] == [u"a"]
+    # punctuation-only sentences are left unchanged
+    tree = next(treeinput.bracket_parser(StringIO(u"(S ($, ,) ($. .))"),
+                                         quiet=True))
+    tree = transform.punctuation_delete(tree, quiet=True)
+    assert [term.data['word'] for term in trees.terminals(tree)] \
+        == [u",", u"."]
 
 
 def test_analysis(discont_tree, cont_tree):
@@ -556,3 +1203,38 @@ def test_analysis(discont_tree, cont_tree):
     sentencecount.run(discont_tree)
     sentencecount.run(cont_tree)
     assert sentencecount.cnt == 2
+    tokencount = treeanalysis.TokenCount()
+    tokencount.run(discont_tree)
+    assert tokencount.token_cnt == len(testdata.WORDS)
+
+
+def test_treearray(discont_tree, cont_tree):
+    """See treearray
+    """
+    pytest.importorskip('numpy')
+    arr = treearray.from_trees([discont_tree, cont_tree])
+    assert len(arr) == 2
+    assert arr.node_count() == 30
+    assert list(arr.parent[:3]) == [-1, 0, 1]
+    assert list(arr.tree_gap_degrees()) == [1, 0]
+    for i, tree in enumerate([discont_tree, cont_tree]):
+        gaps = arr.gap_degrees()[arr.sentence_start[i]:
+                                 arr.sentence_start[i + 1]]
+        assert list(gaps) == [treeanalysis.gap_degree_node(node)
+                              for node in trees.preorder(tree)]
+        rebuilt = arr.tree(i)
+        assert [node.data['label'] for node in trees.preorder(rebuilt)] \
+            == [node.data['label'] for node in trees.preorder(tree)]
+        assert [node.data['word'] for node in trees.terminals(rebuilt)] \
+            == testdata.WORDS
+    gapdegree = treeanalysis.GapDegree()
+    gapdegree.run(arr)
+    assert gapdegree.gaps_per_tree == {0 : 1, 1 : 1}
+    assert gapdegree.gaps_per_node == {0 : 9, 1 : 3}
+    assert treeanalysis.gap_degree(arr) == 1
+    postags = treeanalysis.PosTags()
+    postags.run(arr)
+    assert postags.tags == testdata.POS * 2
+    sentencecount = treeanalysis.SentenceCount()
+    sentencecount.run(arr)
+    assert sentencecount.cnt == 2
@@ -63,6 +63,11 @@ SAMPLE_TIGERXML = """<?xml version="1.0" encoding="utf-8" standalone="yes"?>
 </body>
 </corpus>
 """
+# the sentence of SAMPLE_TIGERXML, followed by a copy with id 2
+SAMPLE_TIGERXML_TWO = SAMPLE_TIGERXML.replace(
+    "</s>\n", "</s>\n" + SAMPLE_TIGERXML[SAMPLE_TIGERXML.index("<s "):
+                                         SAMPLE_TIGERXML.index("</s>\n") + 5]
+    .replace('<s id="1">', '<s id="2">'))
 SAMPLE_EXPORT = """#BOS 1
 Who                     WP      --              --      500
 did                     VB      --              HD      504
@@ -325,3 +330,16 @@ CONT_GRAMMAR_OUTPUT_PMCFG = [
     "s2 -> 0:0",
     "s3 -> 0:0 1:0 2:0 3:0",
     "s4 -> 0:0 1:0"]
+
+
+def deep_export(sid, depth=500):
+    """Return an export sentence with a single word below a unary chain
+    of the given number of nonterminals (deeper than the recursion limit
+    of pickle).
+    """
+    lines = ["#BOS %d" % sid, "a\tNN\t--\t--\t500"]
+    for num in range(500, 500 + depth):
+        parent = num + 1 if num < 499 + depth else 0
+        lines.append("#%d\tX\t--\t--\t%d" % (num, parent))
+    lines.append("#EOS %d" % sid)
+    return "\n".join(lines) + "\n"
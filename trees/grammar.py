@@ -9,7 +9,7 @@ from __future__ import print_function
 import argparse
 import sys
 from collections import Counter
-from . import trees, treeinput, treeanalysis
+from . import trees, treeinput, treeanalysis, treearray
 from . import misc, grammaranalysis, grammaroutput, grammarconst, grammarinput
 
 
@@ -269,8 +269,10 @@ def extract(tree, grammar, lexicon):
     """Extract a PMCFG. We remember "bare" CFG productions, together with
     possible linearizations, together with vertical contexts from the tree
     (for later markovization). So far no extraction of rules from pre-terminal
-    level.
+    level. Instead of a single tree, a tree array can be given.
     """
+    if isinstance(tree, treearray.TreeArray):
+        return extract_array(tree, grammar, lexicon)
     for subtree in trees.preorder(tree):
         if trees.has_children(subtree):
             # map terminal indices to the positions of the rhs elements
@@ -287,11 +289,11 @@ def extract(tree, grammar, lexicon):
             # counters for positions within rhs element
             rhs_argpos = [0] * (len(func) - 1)
             # one lhs argument per block in the tree
-            for block in trees.terminal_blocks(subtree):
+            for start, end in trees.blocks(subtree):
                 lin.append([])
-                # loop through terminals
-                for terminal in block:
-                    rhs_pos = term_map[terminal.data['num']]
+                # loop through terminal positions
+                for num in range(start, end + 1):
+                    rhs_pos = term_map[num]
                     # append the number of the rhs element which covers
                     # the current terminal if nothing has been appended yet
                     # or if the current element is different from the last one
@@ -323,6 +325,79 @@ def extract(tree, grammar, lexicon):
     return grammar
 
 
+def merge(grammar, lexicon, other_grammar, other_lexicon):
+    """Add the counts of a grammar and lexicon extracted with extract() to
+    another grammar and lexicon.
+    """
+    for func in other_grammar:
+        for lin in other_grammar[func]:
+            for vert, cnt in other_grammar[func][lin].items():
+                if not func in grammar:
+                    grammar[func] = {}
+                if not lin in grammar[func]:
+                    grammar[func][lin] = {}
+                if not vert in grammar[func][lin]:
+                    grammar[func][lin][vert] = 0
+                grammar[func][lin][vert] += cnt
+    for word in other_lexicon:
+        if not word in lexicon:
+            lexicon[word] = Counter([])
+        lexicon[word].update(other_lexicon[word])
+    return grammar
+
+
+def extract_array(tree_array, grammar, lexicon):
+    """Grammar extraction as in extract(), operating directly on a tree array
+    (all trees at once).
+    """
+    arr = tree_array
+    symbols = arr.symbols
+    gap_degrees = arr.gap_degrees()
+    for node in range(arr.node_count()):
+        if arr.first_child[node] < 0:
+            word = symbols[arr.word[node]]
+            if not word in lexicon:
+                lexicon[word] = Counter([])
+            lexicon[word].update([symbols[arr.label[node]]])
+            continue
+        term_map = {}
+        func = [symbols[arr.label[node]]]
+        for i, child in enumerate(arr.children(node)):
+            func.append(symbols[arr.label[child]])
+            for num in arr.terminal_nums(child):
+                term_map[num] = i
+        func = tuple(func)
+        nums = arr.terminal_nums(node)
+        lin = []
+        rhs_argpos = [0] * (len(func) - 1)
+        for i, num in enumerate(nums):
+            if i == 0 or nums[i - 1] + 1 < num:
+                if i > 0:
+                    lin[-1] = tuple(lin[-1])
+                lin.append([])
+            rhs_pos = term_map[num]
+            if len(lin[-1]) == 0 or not lin[-1][-1][0] == rhs_pos:
+                lin[-1].append((rhs_pos, rhs_argpos[rhs_pos]))
+                rhs_argpos[rhs_pos] += 1
+        lin[-1] = tuple(lin[-1])
+        lin = tuple(lin)
+        vert = []
+        dom = node
+        while dom >= 0:
+            vert.append("%s%d" % (symbols[arr.label[dom]],
+                                  gap_degrees[dom] + 1))
+            dom = arr.parent[dom]
+        vert = tuple(vert)
+        if not func in grammar:
+            grammar[func] = {}
+        if not lin in grammar[func]:
+            grammar[func][lin] = {}
+        if not vert in grammar[func][lin]:
+            grammar[func][lin][vert] = 0
+        grammar[func][lin][vert] += 1
+    return grammar
+
+
 def add_parser(subparsers):
     """Add an argument parser to the subparsers of treetools.py.
     """
@@ -333,7 +408,8 @@ def add_parser(subparsers):
                                    RawDescriptionHelpFormatter,
                                    description='grammar extraction from' \
                                    ' treebank trees')
-    parser.add_argument('src', help='input file')
+    parser.add_argument('src', help='input file, directory or glob ' \
+                        'pattern (directories and patterns only for trees)')
     parser.add_argument('dest', help='prefix of output files')
     parser.add_argument('gramtype', metavar='T', choices=[t for t in GRAMTYPES],
                         help='type of output grammar (default: %(default)s)',
@@ -368,6 +444,10 @@ def add_parser(subparsers):
                             'the grammar of the form key:value ' \
                             '(default: %(default)s)',
                         default=[])
+    parser.add_argument('--jobs', metavar='N', type=int,
+                        help='number of worker processes for reading ' \
+                        'several input files (default: %(default)s)',
+                        default=1)
     parser.add_argument('--verbose', action='store_true', help='More verbose ' \
                         'messages', default=False)
     parser.add_argument('--usage', nargs=0, help='show detailed information ' \
@@ -421,6 +501,25 @@ class UsageAction(argparse.Action):
         sys.exit()
 
 
+def _extract_file(job):
+    """Extract grammar and lexicon from the trees of a single input file
+    given as tuple of input file and command line arguments.
+    """
+    src, args = job
+    grammar = {}
+    lexicon = {}
+    cnt = 1
+    for tree in getattr(treeinput,
+                        args.src_format)(src, args.src_enc,
+                                         **misc.options_dict \
+                                         (args.src_opts)):
+        extract(tree, grammar, lexicon)
+        if cnt % 100 == 0 and args.jobs <= 1:
+            print("\r%d" % cnt, end="", file=sys.stderr)
+        cnt += 1
+    return grammar, lexicon
+
+
 def run(args):
     """Run the grammar extraction.
     """
@@ -441,15 +540,12 @@ def run(args):
                                                (args.src_opts))
     elif args.src_format in tree_inputformats:
         print("extracting grammar (%s)" % args.gramtype, file=sys.stderr)
-        cnt = 1
-        for tree in getattr(treeinput,
-                            args.src_format)(args.src, args.src_enc,
-                                             **misc.options_dict \
-                                             (args.src_opts)):
-            extract(tree, grammar, lexicon)
-            if cnt % 100 == 0:
-                print("\r%d" % cnt, end="", file=sys.stderr)
-            cnt += 1
+        for file_grammar, file_lexicon in \
+            misc.run_jobs(_extract_file,
+                          [(src, args) for src
+                           in treeinput.input_files(args.src)],
+                          args.jobs):
+            merge(grammar, lexicon, file_grammar, file_lexicon)
     else:
         raise ValueError("Specify input format %s" % args.src_format)
     print("\n", file=sys.stderr)
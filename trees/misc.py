@@ -5,13 +5,24 @@ This module provides misc utility functions.
 
 Author: Wolfgang Maier <maierw@hhu.de>
 """
-import tempfile
+import bz2
+import codecs
 import gzip
+import io
+import multiprocessing
 import sys
+from functools import wraps
 if sys.version_info[0] < 3:
     from itertools import izip_longest
 else:
     from itertools import zip_longest
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
 
 
 def get_doc(funs):
@@ -66,19 +77,153 @@ def bold(text):
     return u'\033[1m%s\033[0m' % text
 
 
-def gunzip(in_file):
-    """If filename ends with .gz, unzip file to temp file and
-    return name of temporary file. This is ugly, but proper streaming
-    support for zipped files does not seem to exist in Python 2.
+class _RawStream(io.RawIOBase):
+    """Adapter which gives a decompressing file object (which in Python 2
+    does not necessarily implement the io interface) a raw stream interface,
+    such that it can be buffered and decoded by the io module.
+    """
+    def __init__(self, fileobj):
+        super(_RawStream, self).__init__()
+        self.fileobj = fileobj
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        data = self.fileobj.read(len(buf))
+        buf[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self.fileobj.close()
+        super(_RawStream, self).close()
+
+
+def open_input(in_file, encoding=None):
+    """Open a file for reading. Files ending with .gz, .bz2 or .xz are
+    decompressed on the fly while reading (.xz needs the lzma module). With
+    an encoding, a text stream is returned, otherwise a binary stream.
     """
     if in_file.endswith('.gz'):
-        with tempfile.NamedTemporaryFile(mode='w+b', delete=False) as tempf, \
-                gzip.open(in_file) as gzipf:
-            data = gzipf.read()
-            tempf.write(data)
-            tempf.flush()
-            in_file = tempf.name
-    return in_file
+        fileobj = gzip.open(in_file, 'rb')
+    elif in_file.endswith('.bz2'):
+        fileobj = bz2.BZ2File(in_file, 'rb')
+    elif in_file.endswith('.xz'):
+        if lzma is None:
+            raise ImportError("reading .xz files requires the lzma module")
+        fileobj = lzma.LZMAFile(in_file, 'rb')
+    elif encoding is None:
+        return io.open(in_file, mode='rb')
+    else:
+        return io.open(in_file, encoding=encoding)
+    stream = io.BufferedReader(_RawStream(fileobj))
+    if encoding is None:
+        return stream
+    return io.TextIOWrapper(stream, encoding=encoding)
+
+
+# number of characters collected by BufferedOutput before writing
+OUTPUT_BUFFER_SIZE = 1 << 18
+
+
+class BufferedOutput(object):
+    """Text output stream which collects written strings in a list and
+    writes them to a binary stream in large chunks, joined and encoded in
+    a single step (with an incremental encoder, such that encodings with
+    a byte order mark work).
+    """
+    def __init__(self, stream, encoding, buffer_size=OUTPUT_BUFFER_SIZE):
+        self.stream = stream
+        self.encoding = encoding
+        self.encode = codecs.getincrementalencoder(encoding)().encode
+        self.buffer_size = buffer_size
+        self.parts = []
+        self.size = 0
+
+    def write(self, text):
+        self.parts.append(text)
+        self.size += len(text)
+        if self.size >= self.buffer_size:
+            self.flush()
+
+    def write_encoded(self, data):
+        """Write data which is already encoded (without byte order mark).
+        """
+        self._write_parts()
+        self.stream.write(data)
+
+    def _write_parts(self):
+        # the first call writes the byte order mark, if any
+        self.stream.write(self.encode(u"".join(self.parts)))
+        self.parts = []
+        self.size = 0
+
+    def flush(self):
+        self._write_parts()
+        self.stream.flush()
+
+    def close(self):
+        if not self.stream.closed:
+            try:
+                self.flush()
+            finally:
+                self.stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_output(out_file, encoding, buffer_size=OUTPUT_BUFFER_SIZE):
+    """Open a file for writing text with the given encoding, see
+    BufferedOutput.
+    """
+    return BufferedOutput(io.open(out_file, mode='wb'), encoding, buffer_size)
+
+
+def memoize(maxsize=1024):
+    """Decorator which memoizes a function with hashable positional
+    arguments. At most maxsize results are kept: when the cache is full,
+    it is emptied before the next result is stored (the memoized
+    functions have small sets of arguments, keeping track of the usage
+    order would cost more than it saves).
+    """
+    def decorator(fun):
+        cache = {}
+        @wraps(fun)
+        def wrapper(*args):
+            try:
+                return cache[args]
+            except KeyError:
+                if len(cache) >= maxsize:
+                    cache.clear()
+                result = cache[args] = fun(*args)
+                return result
+        wrapper.cache_clear = cache.clear
+        return wrapper
+    return decorator
+
+
+def run_jobs(function, jobs, processes=1):
+    """Generator which applies function to every job, using a pool of the
+    given number of worker processes (function and jobs must be picklable).
+    Results are yielded in the order in which the jobs are finished.
+    """
+    if processes <= 1:
+        for job in jobs:
+            yield function(job)
+        return
+    pool = multiprocessing.Pool(processes)
+    try:
+        for result in pool.imap_unordered(function, jobs):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
 
 
 def grouper(n, iterable, fillvalue=None):
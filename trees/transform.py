@@ -8,9 +8,9 @@ Author: Wolfgang Maier <maierw@hhu.de>
 """
 from __future__ import print_function, with_statement
 import argparse
+import itertools
 import sys
 import io
-import os
 from . import trees, treeinput, treeoutput, misc
 
 
@@ -31,51 +31,92 @@ def root_attach(tree):
     """
     tree_terms = trees.terminals(tree)
     # numbers of leftmost and rightmost terminal
-    tree_min = tree_terms[0].data['num']
-    tree_max = tree_terms[-1].data['num']
+    tree_min, tree_max = trees.terminal_bounds(tree)
+    # least common ancestors are answered by an index of the original tree,
+    # taking into account which VROOT children have been moved (see
+    # _root_attach_lca())
+    lca_index = trees.LcaIndex(tree)
+    tops = {}
+    for child in tree.children:
+        for subtree in trees.preorder(child):
+            tops[subtree] = child
+    moved = {}
     # iterate through all VROOT children and try to attach them to the tree,
     # proceed left to right
     for child in trees.children(tree):
-        # indices of terminal children of current child
-        term_ind = [terminal.data['num'] for terminal in trees.terminals(child)]
         # left and right neighbor of lefmost and rightmost terminal child
-        t_l = min(term_ind) - 1
-        t_r = max(term_ind) + 1
+        t_l, t_r = trees.terminal_bounds(child)
+        t_l -= 1
+        t_r += 1
         # on the right, we have to skip over all adjacent terminals which are
         # dominated by siblings of the current child of VROOT
         focus = child
         sibling = trees.right_sibling(focus)
         while not sibling == None:
-            focus_ind = [terminal.data['num'] for terminal
-                         in trees.terminals(focus)]
-            sibling_ind = [terminal.data['num'] for terminal
-                           in trees.terminals(sibling)]
+            focus_min, focus_max = trees.terminal_bounds(focus)
+            sibling_min, sibling_max = trees.terminal_bounds(sibling)
             # skip over sibling if it starts left of the end
             # of the current focus node. Example: right sibling of current
             # child is a phrase, sibling of the phrase is punctuation
             # which interrupts this same phrase
-            if min(sibling_ind) < max(focus_ind):
+            if sibling_min < focus_max:
                 sibling = trees.right_sibling(sibling)
                 continue
             # gap found, i.e., sibling not adjacent to current node: we are done
-            if min(sibling_ind) > max(focus_ind) + 1:
+            if sibling_min > focus_max + 1:
                 break
             # neither skip nor done: update right boundary and try next sibling
-            t_r = max(sibling_ind) + 1
+            t_r = sibling_max + 1
             focus = sibling
             sibling = trees.right_sibling(sibling)
         # ignore if beyond sentence
         if t_l < tree_min or t_r > tree_max:
             continue
         # target for movement is least common ancestor of terminal neighbors
-        target = trees.lca(tree_terms[t_l - 1], tree_terms[t_r - 1])
+        target = _root_attach_lca(lca_index, tops, moved,
+                                  tree_terms[t_l - 1], tree_terms[t_r - 1])
         # move/attach node
-        child.parent.children.remove(child)
-        target.children.append(child)
-        child.parent = target
+        if not target == tree:
+            trees.move_subtree(child, target)
+            moved[child] = target
     return tree
 
 
+def _root_attach_lca(lca_index, tops, moved, node_a, node_b):
+    """Least common ancestor during root_attach(). The tree consists of the
+    original subtrees below the VROOT children (tops), some of which have
+    been moved below a node in another one (moved). As in the usual
+    algorithm with node depths, we lift the node whose top has been moved
+    more often (the depth in the tree of tops) until both are in the same
+    original subtree, where the index of the original tree can be used.
+    """
+    while True:
+        top_a = tops.get(node_a)
+        top_b = tops.get(node_b)
+        if top_a is None or top_b is None:
+            return lca_index.root
+        if top_a == top_b:
+            return lca_index.lca(node_a, node_b)
+        level_a = _root_attach_level(tops, moved, top_a)
+        level_b = _root_attach_level(tops, moved, top_b)
+        if level_a == 0 and level_b == 0:
+            return lca_index.root
+        if level_a >= level_b:
+            node_a = moved[top_a]
+        else:
+            node_b = moved[top_b]
+
+
+def _root_attach_level(tops, moved, top):
+    """Number of moves between a VROOT child (top) and VROOT.
+    """
+    level = 0
+    while top in moved:
+        top = tops[moved[top]]
+        level += 1
+    return level
+
+
 def boyd_split(tree):
     """For each continuous terminal block of a discontinuous node in tree,
     introduce a node which covers exactly this block. A single unique
@@ -104,8 +145,8 @@ def boyd_split(tree):
             if len(blocks) == 0:
                 blocks.append([])
             else:
-                last_terminal = trees.terminals(blocks[-1][-1])[-1].data['num']
-                if trees.terminals(child)[0].data['num'] > last_terminal + 1:
+                last_terminal = trees.terminal_bounds(blocks[-1][-1])[1]
+                if trees.terminal_bounds(child)[0] > last_terminal + 1:
                     blocks.append([])
             blocks[-1].append(child)
         parent = subtree.parent
@@ -113,8 +154,7 @@ def boyd_split(tree):
         split = []
         if len(blocks) > 1:
             # unhook node
-            parent.children.remove(subtree)
-            subtree.parent = None
+            trees.remove_child(parent, subtree)
             # for each of the blocks, create a split node
             for i, block in enumerate(blocks):
                 # the new node:
@@ -125,8 +165,7 @@ def boyd_split(tree):
                 split[-1].data['head'] = subtree.data['head']
                 split[-1].data[h_block] = False
                 split[-1].data['block_number'] = (i + 1)
-                parent.children.append(split[-1])
-                split[-1].parent = parent
+                trees.add_child(parent, split[-1])
                 # iterate through children of original node in
                 # the current block
                 for child in block:
@@ -137,9 +176,7 @@ def boyd_split(tree):
                         or child.data['head'] and \
                         ((not child.data['split']) or child.data[h_block])
                     # move child below new block node
-                    subtree.children.remove(child)
-                    split[-1].children.append(child)
-                    child.parent = split[-1]
+                    trees.move_subtree(child, split[-1])
     return tree
 
 
@@ -161,12 +198,9 @@ def raising(tree):
                     removal.append(subtree)
     for subtree in removal:
         parent = subtree.parent
-        parent.children.remove(subtree)
-        subtree.parent = None
+        trees.remove_child(parent, subtree)
         for child in trees.children(subtree):
-            subtree.children.remove(child)
-            parent.children.append(child)
-            child.parent = parent
+            trees.move_subtree(child, parent)
     return tree
 
 
@@ -178,14 +212,13 @@ def add_topnode(tree, **params):
     Parameters: none
     Output options: none
     """
-    top = trees.Tree(trees.make_node_data())
+    top = trees.Tree()
     top.data['label'] = u"TOP"
-    top.children.append(tree)
     top.data['morph'] = trees.DEFAULT_MORPH
     top.data['edge'] = trees.DEFAULT_EDGE
     top.data['lemma'] = trees.DEFAULT_LEMMA
     top.data['sid'] = tree.data['sid']
-    tree.parent = top
+    trees.add_child(top, tree)
     return top
 
 
@@ -308,7 +341,7 @@ def insert_terminals(tree, **params):
                           % (len(trees.terminals(tree)),
                              terminal_num))
             continue
-        node = trees.Tree(trees.make_node_data())
+        node = trees.Tree()
         node.data['word'] = insert_terminals. \
             terminals[tree.data['sid']][terminal_num][0]
         node.data['label'] = insert_terminals. \
@@ -322,10 +355,9 @@ def insert_terminals(tree, **params):
         treeterms = trees.terminals(tree)
         for term in treeterms:
             if term.data['num'] >= terminal_num:
-                term.data['num'] += 1
+                trees.set_num(term, term.data['num'] + 1)
         # insert this one
-        tree.children.append(node)
-        node.parent = tree
+        trees.add_child(tree, node)
     return tree
 
 
@@ -350,8 +382,7 @@ def punctuation_delete(tree, **params):
             sys.stderr.write('\ndelete_punctuation: no mod on %d, ' \
                                  'punctuation only\n' % tree.data['sid'])
     else:
-        for terminal in removal:
-            tree = trees.delete_terminal(tree, terminal)
+        tree = trees.delete_terminals(tree, removal)
         for line in output:
             print(line)
     return tree
@@ -377,9 +408,7 @@ def punctuation_verylow(tree, **params):
                     for child in element.parent.children]):
             target = terminals[i - 1].parent
             if not target == element.parent:
-                element.parent.children.remove(element)
-                element.parent = target
-                target.children.append(element)
+                trees.move_subtree(element, target)
     return tree
 
 
@@ -418,9 +447,7 @@ def punctuation_symetrify(tree, **params):
             cand = terms[candnum - 1]
             if cand.data['word'] in trees.PAIRPUNCT \
                and not cand in done:
-                cand.parent.children.remove(cand)
-                cand.parent = terminal.parent
-                terminal.parent.children.append(cand)
+                trees.move_subtree(cand, terminal.parent)
                 done.append(cand)
                 done.append(terminal)
         if terminal in done:
@@ -431,9 +458,7 @@ def punctuation_symetrify(tree, **params):
             cand = terms[candnum - 1]
             if cand.data['word'] in trees.PAIRPUNCT \
                and not cand in done:
-                cand.parent.children.remove(cand)
-                cand.parent = terminal.parent
-                terminal.parent.children.append(cand)
+                trees.move_subtree(cand, terminal.parent)
                 done.append(cand)
                 done.append(terminal)
     return tree
@@ -451,9 +476,7 @@ def punctuation_root(tree, **params):
              if terminal.data['word'] in trees.PUNCT \
              and len(trees.children(terminal.parent)) > 1]
     for p in punct:
-        p.parent.children.remove(p)
-        tree.children.append(p)
-        p.parent = tree
+        trees.move_subtree(p, tree)
     return tree
 
 
@@ -464,13 +487,12 @@ def ptb_delete_traces(tree, **params):
     Parameters: none
     Output options: none
     """
-    for trace in [terminal for terminal in trees.terminals(tree)
-                  if terminal.data['label'] == "-NONE-"]:
-        trees.delete_terminal(tree, trace)
+    trees.delete_terminals(tree, [terminal for terminal
+                                  in trees.terminals(tree)
+                                  if terminal.data['label'] == "-NONE-"])
     for node in trees.preorder(tree):
         label = trees.parse_label(node.data['label'])
-        label.coindex = ""
-        node.data['label'] = trees.format_label(label)
+        node.data['label'] = trees.format_label(label._replace(coindex=""))
     return tree
 
 
@@ -553,17 +575,21 @@ def mark_heads_by_rules(tree, **params):
 
 
 def _binarize_tree(tree):
-    """Recursively binarize this tree.
+    """Binarize this tree bottom-up.
+    """
+    for subtree in trees.postorder(tree):
+        _binarize_node(subtree)
+
+
+def _binarize_node(tree):
+    """Binarize the children of a single node.
     """
-    if not trees.has_children(tree):
-        return tree
-    for child in trees.children(tree):
-        _binarize_tree(child)
     if len(trees.children(tree)) > 2:
         direction = "left"
         remaining = trees.children(tree)
         last_tree = tree
-        tree.children = []
+        for child in remaining:
+            trees.remove_child(tree, child)
         label = tree.data['label']
         child = None
         binarization_tree = None
@@ -579,15 +605,12 @@ def _binarize_tree(tree):
             elif direction == 'right':
                 child = remaining[-1]
                 remaining = remaining[:-1]
-            last_tree.children.append(binarization_tree)
-            last_tree.children.append(child)
-            binarization_tree.parent = last_tree
-            child.parent = last_tree
+            trees.add_child(last_tree, binarization_tree)
+            trees.add_child(last_tree, child)
             last_tree = binarization_tree
         for i in range(2):
             child = remaining[i]
-            binarization_tree.children.append(child)
-            child.parent = binarization_tree
+            trees.add_child(binarization_tree, child)
 
 
 def binarize(tree, **params):
@@ -611,8 +634,19 @@ def add_parser(subparsers):
                                    description='Offers transformation and ' \
                                        'format conversion for constituency ' \
                                        'treebank trees.')
-    parser.add_argument('src', help='input file')
+    parser.add_argument('src', help='input file, directory or glob ' \
+                            'pattern (then, output goes to SRCFILE.dest ' \
+                            'for each input file)')
     parser.add_argument('dest', help='output file')
+    parser.add_argument('--jobs', metavar='N', type=int,
+                        help='number of worker processes for reading ' \
+                            'several input files (default: %(default)s)',
+                        default=1)
+    parser.add_argument('--write-jobs', metavar='N', type=int,
+                        help='number of worker processes for rendering ' \
+                            'and encoding the output trees, which are ' \
+                            'written in order (default: %(default)s)',
+                        default=1)
     parser.add_argument('--counting', metavar='n', type=int,
                         help='display number of processed sentences every n ' \
                             ' sentences (default: %(default)s)',
@@ -699,6 +733,38 @@ class UsageAction(argparse.Action):
         sys.exit()
 
 
+def _transform_trees(tree_iter, args, progress=True):
+    """Generator which applies the transformations given on the command
+    line to the trees and shows the number of processed trees.
+    """
+    params = misc.options_dict(args.params)
+    for cnt, tree in enumerate(tree_iter, 1):
+        for algorithm in args.trans:
+            tree = globals()[algorithm](tree, **params)
+        if progress and cnt % args.counting == 0:
+            sys.stderr.write("\r%d" % cnt)
+        yield tree
+
+
+def _transform_file(job):
+    """Transform the trees of a single input file given as tuple of input
+    file, output file and command line arguments. Return the number of
+    trees.
+    """
+    src, dest, args = job
+    print("%s --> %s" % (src, dest), file=sys.stderr)
+    tree_iter = getattr(treeinput, args.src_format)\
+        (src, args.src_enc, **misc.options_dict(args.src_opts))
+    with misc.open_output(dest, args.dest_enc) as dest_stream:
+        cnt = treeoutput.write_trees(_transform_trees(tree_iter, args,
+                                                      args.jobs <= 1),
+                                     args.dest_format, dest_stream,
+                                     args.write_jobs,
+                                     **misc.options_dict(args.dest_opts))
+    sys.stderr.write("\n")
+    return cnt
+
+
 def run(args):
     """Runs the transformation given command line arguments.
     """
@@ -709,70 +775,46 @@ def run(args):
     sys.stderr.write("applying %s\n" % args.trans)
     if not args.split == "":
         sys.stderr.write("splitting output like this: %s\n" % args.split)
-    cnt = 1
-    params = misc.options_dict(args.params)
     if args.split == '':
-        files = []
-        if os.path.isdir(args.src):
-            for srcfile in os.listdir(args.src):
-                srcfile = os.path.join(args.src, srcfile)
-                destfile = "%s.dest" % srcfile
-                files.append((srcfile, destfile))
-        else:
-            files.append((args.src, args.dest))
-        for src, dest in files:
-            print("%s --> %s" % (src, dest), file=sys.stderr)
-            with io.open(dest, 'w', encoding=args.dest_enc) as dest_stream:
-                getattr(treeoutput, args.dest_format + '_begin')\
-                    (dest_stream,
-                     **misc.options_dict(args.dest_opts))
-                for tree in getattr(treeinput,
-                                    args.src_format)(src, args.src_enc,
-                                                     **misc.options_dict \
-                                                     (args.src_opts)):
-                    for algorithm in args.trans:
-                        tree = globals()[algorithm](tree, **params)
-                    getattr(treeoutput, args.dest_format)(tree, dest_stream,
-                                                          **misc.options_dict \
-                                                          (args.dest_opts))
-                    if cnt % args.counting == 0:
-                        sys.stderr.write("\r%d" % cnt)
-                    cnt += 1
-                getattr(treeoutput, args.dest_format + '_end')\
-                    (dest_stream,
-                     **misc.options_dict(args.dest_opts))
-            sys.stderr.write("\n")
+        files = [(args.src, args.dest)]
+        if treeinput.is_multiple_input(args.src):
+            files = [(srcfile, "%s.dest" % srcfile)
+                     for srcfile in treeinput.input_files(args.src)]
+        cnt = 0
+        for file_cnt in misc.run_jobs(_transform_file,
+                                      [(src, dest, args)
+                                       for src, dest in files],
+                                      min(args.jobs, len(files))):
+            cnt += file_cnt
+        if len(files) > 1:
+            sys.stderr.write("%d sentences in %d files\n" % (cnt, len(files)))
     else:
-        if os.path.isdir(args.src):
-            raise ValueError("cannot split input when reading entire directory")
-        cnt = 1
-        tree_list = []
-        sys.stderr.write("reading...\n")
-        for tree in getattr(treeinput, args.src_format)(args.src, args.src_enc,
-                                                        **misc.options_dict \
-                                                        (args.src_opts)):
-            for algorithm in args.trans:
-                tree = globals()[algorithm](tree,
-                                            **misc.options_dict(args.params))
-            tree_list.append(tree)
-            if cnt % args.counting == 0:
-                sys.stderr.write("\r%d" % cnt)
-            cnt += 1
-        sys.stderr.write("\n")
-        parts = treeoutput.parse_split_specification(args.split, len(tree_list))
-        tree_iter = iter(tree_list)
+        if treeinput.is_multiple_input(args.src):
+            raise ValueError("cannot split input when reading several files")
+        src_opts = misc.options_dict(args.src_opts)
+        dest_opts = misc.options_dict(args.dest_opts)
+        sys.stderr.write("counting...\n")
+        size = treeinput.count_sentences(args.src, args.src_enc,
+                                         args.src_format, **src_opts)
+        parts = treeoutput.parse_split_specification(args.split, size)
         sys.stderr.write("writing parts of sizes %s\n" % str(parts))
+        tree_iter = _transform_trees(getattr(treeinput, args.src_format)
+                                     (args.src, args.src_enc, **src_opts),
+                                     args)
+        cnt = 0
         for i, part_size in enumerate(parts):
             sys.stderr.write("writing part %d\n" % i)
-            with io.open("%s.%d" % (args.dest, i), 'w',
-                         encoding=args.dest_enc) as dest_stream:
-                for tree_ind in range(0, part_size):
-                    getattr(treeoutput, args.dest_format) \
-                        (tree_iter.next(), dest_stream, \
-                         **misc.options_dict(args.dest_opts))
-                    if tree_ind % args.counting == 0:
-                        sys.stderr.write("\r%d" % tree_ind)
+            with misc.open_output("%s.%d" % (args.dest, i),
+                                  args.dest_enc) as dest_stream:
+                cnt += treeoutput.write_trees(itertools.islice(tree_iter,
+                                                               part_size),
+                                              args.dest_format, dest_stream,
+                                              args.write_jobs, **dest_opts)
                 sys.stderr.write("\n")
+        if cnt < size:
+            # the reader has skipped sentences
+            sys.stderr.write("warning: only %d of %d sentences written, last "
+                             "parts are smaller\n" % (cnt, size))
 
 
 TRANSFORMATIONS = [root_attach, boyd_split, raising, add_topnode, 
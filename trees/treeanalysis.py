@@ -9,7 +9,7 @@ from __future__ import division, print_function
 import argparse
 import sys
 from collections import Counter
-from . import trees, treeinput, misc
+from . import trees, treeinput, treearray, misc
 
 
 class PosTags(object):
@@ -19,11 +19,24 @@ class PosTags(object):
         self.tags = []
 
     def run(self, tree):
-        """Collect and count POS tags (preterminal labels) in a single tree.
+        """Collect and count POS tags (preterminal labels) in a single tree
+        or a tree array.
         """
+        if isinstance(tree, treearray.TreeArray):
+            terms = treearray.numpy.nonzero(tree.is_terminal())[0]
+            terms = terms[treearray.numpy.lexsort((tree.num[terms],
+                                                   tree.sentence_of()[terms]))]
+            self.tags.extend([tree.symbols[label]
+                              for label in tree.label[terms]])
+            return
         for term in trees.terminals(tree):
             self.tags.append(term.data['label'])
 
+    def merge(self, other):
+        """Add the tags collected by another instance.
+        """
+        self.tags.extend(other.tags)
+
     def done(self):
         """Print summary and write tags. To be extended.
         """
@@ -37,15 +50,34 @@ class PosTags(object):
 
 
 class SentenceCount(object):
-    """Accumulates statistics concerning gap degree over several trees.
+    """Counts sentences (and tokens, which are reported by TokenCount).
+    Works on sentence records, i.e., without building trees.
     """
+    records = True
+
     def __init__(self):
         self.cnt = 0
+        self.token_cnt = 0
 
     def run(self, tree):
-        """Collect and count POS tags (preterminal labels) in a single tree.
+        """Count a single tree, a sentence record (treeinput.SentenceRecord)
+        or all trees of a tree array.
         """
-        self.cnt += 1
+        if isinstance(tree, treearray.TreeArray):
+            self.cnt += len(tree)
+            self.token_cnt += int(tree.is_terminal().sum())
+        elif isinstance(tree, treeinput.SentenceRecord):
+            self.cnt += 1
+            self.token_cnt += tree.token_count
+        else:
+            self.cnt += 1
+            self.token_cnt += len(trees.terminals(tree))
+
+    def merge(self, other):
+        """Add the counts of another instance.
+        """
+        self.cnt += other.cnt
+        self.token_cnt += other.token_cnt
 
     def done(self):
         """Print summary and write tags. To be extended.
@@ -55,17 +87,24 @@ class SentenceCount(object):
         print("%d sentences" % self.cnt)
 
 
+class TokenCount(SentenceCount):
+    """Counts sentences and tokens, like SentenceCount, and reports both.
+    """
+    def done(self):
+        """Print summary.
+        """
+        print("*** Token count summary ***")
+        print()
+        print("%d sentences" % self.cnt)
+        print("%d tokens" % self.token_cnt)
+
+
 def gap_degree_node(node):
     """Compute gap degree for a single node.
     """
     if not trees.has_children(node):
         return 0
-    node_gap_deg = 0
-    terms = trees.terminals(node)
-    for i, _ in enumerate(terms[:-1]):
-        if terms[i].data['num'] + 1 < terms[i + 1].data['num']:
-            node_gap_deg += 1
-    return node_gap_deg
+    return trees.gap_degree(node)
 
 
 class GapDegree(object):
@@ -79,7 +118,21 @@ class GapDegree(object):
 
     def run(self, tree):
         """Return the maximal gap degree of any node of the given tree.
+        For tree arrays, all trees are processed at once.
         """
+        if isinstance(tree, treearray.TreeArray):
+            numpy = treearray.numpy
+            node_gap_degs = tree.gap_degrees()[~tree.is_terminal()]
+            for gap_deg, cnt in enumerate(numpy.bincount(node_gap_degs)):
+                if cnt > 0:
+                    self.gaps_per_node[gap_deg] = \
+                        self.gaps_per_node.get(gap_deg, 0) + int(cnt)
+            for gap_deg, cnt in enumerate(numpy.bincount(
+                    tree.tree_gap_degrees())):
+                if cnt > 0:
+                    self.gaps_per_tree[gap_deg] = \
+                        self.gaps_per_tree.get(gap_deg, 0) + int(cnt)
+            return
         tree_gap_deg = 0
         for subtree in trees.preorder(tree):
             # skip terminals
@@ -95,6 +148,14 @@ class GapDegree(object):
             self.gaps_per_tree[tree_gap_deg] = 0
         self.gaps_per_tree[tree_gap_deg] += 1
 
+    def merge(self, other):
+        """Add the statistics collected by another instance.
+        """
+        for gaps, other_gaps in [(self.gaps_per_node, other.gaps_per_node),
+                                 (self.gaps_per_tree, other.gaps_per_tree)]:
+            for gap_deg, cnt in other_gaps.items():
+                gaps[gap_deg] = gaps.get(gap_deg, 0) + cnt
+
     def done(self):
         """Compute and print summary about gap degree statistics collected
         during all runs of run().
@@ -126,8 +187,11 @@ class GapDegree(object):
 
 
 def gap_degree(tree):
-    """Return the maximal gap degree of the nodes in the given tree.
+    """Return the maximal gap degree of the nodes in the given tree
+    (or of all trees in a tree array).
     """
+    if isinstance(tree, treearray.TreeArray):
+        return int(tree.gap_degrees().max())
     return max([gap_degree_node(subtree) for subtree in trees.preorder(tree)])
 
 
@@ -139,8 +203,12 @@ def add_parser(subparsers):
                                    formatter_class=argparse.
                                    RawDescriptionHelpFormatter,
                                    description='analysis of treebank trees')
-    parser.add_argument('src', help='input file')
+    parser.add_argument('src', help='input file, directory or glob pattern')
     parser.add_argument('task', help='task to perform')
+    parser.add_argument('--jobs', metavar='N', type=int,
+                        help='number of worker processes for reading ' \
+                            'several input files (default: %(default)s)',
+                        default=1)
     # # for the future
     # parser.add_argument('--params', nargs='+', metavar='P',
     #                     help='space separated list of task ' \
@@ -184,24 +252,45 @@ class UsageAction(argparse.Action):
         sys.exit()
 
 
-def run(args):
-    """Run the task on trees.
+def _analyze_file(job):
+    """Run a task on the trees of a single input file given as tuple of
+    input file and command line arguments. Return the task instance.
     """
-    sys.stderr.write("reading from '%s' in format '%s' and encoding '%s'\n"
-                     % (args.src, args.src_format, args.src_enc))
-    sys.stderr.write("running %s\n" % args.task)
+    src, args = job
     cnt = 1
     task_instance = globals()[args.task]()
-    for tree in getattr(treeinput,
-                        args.src_format)(args.src, args.src_enc,
-                                         **misc.options_dict \
-                                         (args.src_opts)):
+    if getattr(task_instance, 'records', False):
+        # task does not need trees
+        reader = treeinput.records(src, args.src_enc, args.src_format,
+                                   **misc.options_dict(args.src_opts))
+    else:
+        reader = getattr(treeinput,
+                         args.src_format)(src, args.src_enc,
+                                          **misc.options_dict \
+                                          (args.src_opts))
+    for tree in reader:
         tree = task_instance.run(tree)
-        if cnt % 100 == 0:
+        if cnt % 100 == 0 and args.jobs <= 1:
             sys.stderr.write("\r%d" % cnt)
         cnt += 1
+    return task_instance
+
+
+def run(args):
+    """Run the task on trees. Several input files are processed by
+    separate task instances, which are merged at the end.
+    """
+    sys.stderr.write("reading from '%s' in format '%s' and encoding '%s'\n"
+                     % (args.src, args.src_format, args.src_enc))
+    sys.stderr.write("running %s\n" % args.task)
+    task_instance = globals()[args.task]()
+    for result in misc.run_jobs(_analyze_file,
+                                [(src, args) for src
+                                 in treeinput.input_files(args.src)],
+                                args.jobs):
+        task_instance.merge(result)
     task_instance.done()
     sys.stderr.write("\n")
 
 
-TASKS = [GapDegree, PosTags, SentenceCount]
+TASKS = [GapDegree, PosTags, SentenceCount, TokenCount]
@@ -0,0 +1,233 @@
+"""
+treetools: Tools for transforming treebank trees.
+
+This module provides a columnar representation of trees. The nodes of
+one or several sentences are stored in NumPy arrays (parent index, first
+child, next sibling, terminal number, interned symbol ids), which needs
+only a fraction of the memory of linked trees.Tree objects and allows
+for vectorized computations over whole treebanks. NumPy is only required
+when this module is actually used.
+
+Author: Wolfgang Maier <maierw@hhu.de>
+"""
+from __future__ import print_function
+import array
+try:
+    import numpy
+except ImportError:
+    numpy = None
+from . import trees
+
+
+# node fields which are stored as symbol ids
+SYMBOL_FIELDS = ['word', 'lemma', 'label', 'morph', 'edge']
+
+
+def _require_numpy():
+    """Raise an error if NumPy is not available.
+    """
+    if numpy is None:
+        raise ImportError("tree arrays require NumPy")
+
+
+class TreeArray(object):
+    """Columnar representation of a sequence of trees. Nodes are numbered
+    globally; the nodes of each sentence form a contiguous range in
+    preorder (children ordered as by trees.children()), such that the
+    subtree below node i occupies the range [i, i + size[i]).
+
+    Arrays (one entry per node):
+       parent        index of parent, -1 for roots
+       first_child   index of leftmost child, -1 for terminals
+       next_sibling  index of right sibling, -1 if none
+       size          number of nodes in the subtree
+       depth         distance to the root
+       num           terminal number, 0 for non-terminals
+       word, lemma, label, morph, edge
+                     ids in the symbol table (a trees.SymbolTable,
+                     by default a new one, see trees.symbol_table())
+    Arrays (one entry per sentence):
+       sentence_start  index of the root, with an extra final entry
+                       holding the total number of nodes
+       sid             sentence ids (-1 if not present)
+    """
+    def __init__(self, symbols=None):
+        _require_numpy()
+        self.symbols = trees.symbol_table() if symbols is None else symbols
+        empty = numpy.zeros(0, dtype=numpy.int32)
+        self.parent = empty
+        self.first_child = empty
+        self.next_sibling = empty
+        self.size = empty
+        self.depth = empty
+        self.num = empty
+        for field in SYMBOL_FIELDS:
+            setattr(self, field, empty)
+        self.sentence_start = numpy.zeros(1, dtype=numpy.int64)
+        self.sid = empty
+
+    def __len__(self):
+        return len(self.sentence_start) - 1
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.tree(i)
+
+    def node_count(self):
+        """Return the total number of nodes.
+        """
+        return len(self.parent)
+
+    def is_terminal(self):
+        """Return a boolean mask of the terminal nodes.
+        """
+        return self.first_child < 0
+
+    def sentence_of(self):
+        """Return the index of the sentence of each node.
+        """
+        return numpy.repeat(numpy.arange(len(self), dtype=numpy.int32),
+                            numpy.diff(self.sentence_start))
+
+    def children(self, node):
+        """Return the ordered children of a node.
+        """
+        result = []
+        child = self.first_child[node]
+        while child >= 0:
+            result.append(child)
+            child = self.next_sibling[child]
+        return result
+
+    def terminal_nums(self, node):
+        """Return the sorted numbers of the terminals below a node.
+        """
+        nums = self.num[node:node + self.size[node]]
+        return numpy.sort(nums[nums > 0])
+
+    def lca(self, nodes_a, nodes_b):
+        """Return the least common ancestors of two arrays of nodes (which
+        must pairwise belong to the same sentence), computed by lifting
+        all pairs level by level at once.
+        """
+        nodes_a = numpy.array(nodes_a, dtype=numpy.int32)
+        nodes_b = numpy.array(nodes_b, dtype=numpy.int32)
+        depth_a = self.depth[nodes_a]
+        depth_b = self.depth[nodes_b]
+        for nodes, depth, other in [(nodes_a, depth_a, depth_b),
+                                    (nodes_b, depth_b, depth_a)]:
+            deeper = depth > other
+            while deeper.any():
+                nodes[deeper] = self.parent[nodes[deeper]]
+                depth[deeper] -= 1
+                deeper = depth > other
+        differ = nodes_a != nodes_b
+        while differ.any():
+            nodes_a[differ] = self.parent[nodes_a[differ]]
+            nodes_b[differ] = self.parent[nodes_b[differ]]
+            differ = nodes_a != nodes_b
+        return nodes_a
+
+    def gap_degrees(self):
+        """Return the gap degree of every node. A terminal t starts a
+        continuous block of all of its ancestors up to (excluding) the
+        least common ancestor with the terminal numbered one less than t.
+        These path increments are accumulated with prefix sums over the
+        preorder subtree ranges.
+        """
+        terms = numpy.nonzero(self.is_terminal())[0]
+        sentences = self.sentence_of()[terms]
+        terms = terms[numpy.lexsort((self.num[terms], sentences))]
+        sentences = self.sentence_of()[terms]
+        nums = self.num[terms]
+        delta = numpy.zeros(self.node_count(), dtype=numpy.int64)
+        numpy.add.at(delta, terms, 1)
+        has_prev = numpy.zeros(len(terms), dtype=bool)
+        has_prev[1:] = (sentences[1:] == sentences[:-1]) \
+            & (nums[1:] == nums[:-1] + 1)
+        current = terms[has_prev]
+        previous = terms[numpy.nonzero(has_prev)[0] - 1]
+        numpy.add.at(delta, self.lca(current, previous), -1)
+        prefix = numpy.zeros(self.node_count() + 1, dtype=numpy.int64)
+        numpy.cumsum(delta, out=prefix[1:])
+        index = numpy.arange(self.node_count())
+        blocks = prefix[index + self.size] - prefix[index]
+        return (blocks - 1).astype(numpy.int32)
+
+    def tree_gap_degrees(self):
+        """Return the maximal gap degree of the nodes of each sentence.
+        """
+        if len(self) == 0:
+            return numpy.zeros(0, dtype=numpy.int32)
+        return numpy.maximum.reduceat(self.gap_degrees(),
+                                      self.sentence_start[:-1])
+
+    def tree(self, index):
+        """Build a trees.Tree for the sentence with the given index. Only
+        the node fields and the sentence id are restored.
+        """
+        start = self.sentence_start[index]
+        end = self.sentence_start[index + 1]
+        nodes = []
+        for i in range(start, end):
+            node = trees.Tree()
+            for field in SYMBOL_FIELDS:
+                node.data[field] = self.symbols[getattr(self, field)[i]]
+            if self.num[i] > 0:
+                node.data['num'] = int(self.num[i])
+            if self.parent[i] >= 0:
+                trees.add_child(nodes[self.parent[i] - start], node)
+            nodes.append(node)
+        if self.sid[index] >= 0:
+            nodes[0].data['sid'] = int(self.sid[index])
+        return nodes[0]
+
+
+def from_trees(tree_iter, symbols=None):
+    """Build a TreeArray from an iterable of trees. Arrays are filled
+    incrementally, trees can therefore be consumed directly from a reader.
+    """
+    _require_numpy()
+    result = TreeArray(symbols)
+    columns = dict((name, array.array('i')) for name in
+                   ['parent', 'first_child', 'next_sibling', 'size',
+                    'depth', 'num'] + SYMBOL_FIELDS)
+    starts = array.array('l', [0])
+    sids = array.array('l')
+    offset = 0
+    for tree in tree_iter:
+        index = {}
+        siblings = []
+        nodes = list(trees.preorder(tree))
+        for i, node in enumerate(nodes):
+            index[node] = offset + i
+        for i, node in enumerate(nodes):
+            columns['parent'].append(-1 if node is tree
+                                     else index[node.parent])
+            ordered = trees.children(node)
+            columns['first_child'].append(index[ordered[0]] if ordered
+                                          else -1)
+            columns['next_sibling'].append(-1)
+            columns['size'].append(1)
+            columns['depth'].append(0 if node is tree else
+                                    columns['depth'][index[node.parent]])
+            if node is not tree:
+                columns['depth'][-1] += 1
+            columns['num'].append(0 if ordered else node.data['num'])
+            for field in SYMBOL_FIELDS:
+                columns[field].append(result.symbols.id(node.data[field]))
+            siblings.extend(zip(ordered, ordered[1:]))
+        for left, right in siblings:
+            columns['next_sibling'][index[left]] = index[right]
+        # subtree sizes, children come after their parents in preorder
+        for i in range(len(nodes) - 1, 0, -1):
+            parent = columns['parent'][offset + i]
+            columns['size'][parent] += columns['size'][offset + i]
+        offset += len(nodes)
+        starts.append(offset)
+        sids.append(tree.data['sid'] if 'sid' in tree.data else -1)
+    for name, column in columns.items():
+        setattr(result, name, numpy.array(column, dtype=numpy.int32))
+    result.sentence_start = numpy.array(starts, dtype=numpy.int64)
+    result.sid = numpy.array(sids, dtype=numpy.int32)
+    return result
@@ -0,0 +1,193 @@
+"""
+treetools: Tools for transforming treebank trees.
+
+This module provides an on-disk cache of parsed treebanks. When a reader
+is called with the cache option, the trees are stored in a compact binary
+serialization (marshal) next to the input file while they are read. The
+cache file is keyed by reader, encoding and options; it is used by later
+calls as long as size and modification time of the input file are
+unchanged.
+
+Author: Wolfgang Maier <maierw@hhu.de>
+"""
+from __future__ import print_function
+import functools
+import hashlib
+import marshal
+import os
+import sys
+from . import trees
+
+
+# increase when the serialization changes
+CACHE_VERSION = 2
+# file name suffix of the cache files
+CACHE_SUFFIX = ".cache"
+# reader options which do not affect the trees
+IGNORED_OPTIONS = ['cache', 'quiet', 'symbols', 'export_jobs',
+                   'export_unordered', 'brackets_jobs', 'tigerxml_stream']
+# reader options with which the trees are not yielded in file order; an
+# existing cache is used, but none is written
+UNORDERED_OPTIONS = ['export_unordered']
+
+
+def dump_tree(tree):
+    """Return a marshallable representation of a tree: a tuple with an
+    entry (parent index, slot values, overflow dict) per node, in preorder
+    (following the unordered children lists). Absent slot fields are
+    represented by Ellipsis.
+    """
+    result = []
+    stack = [(tree, -1)]
+    while stack:
+        node, parent = stack.pop()
+        index = len(result)
+        data = node.data
+        result.append((parent,
+                       tuple([getattr(data, field, Ellipsis)
+                              for field in trees.NODE_FIELDS]),
+                       data.extra))
+        stack.extend([(child, index) for child in reversed(node.children)])
+    return tuple(result)
+
+
+def load_tree(nodes, symbols=None):
+    """Build a tree from the output of dump_tree(). Labels, edges, morph
+    tags and lemmas are interned in the given symbol table, if any.
+    """
+    intern = trees.interner(symbols)
+    new_tree = trees.Tree.__new__
+    new_data = trees.NodeData.__new__
+    newid = trees.Tree.newid
+    Tree = trees.Tree
+    NodeData = trees.NodeData
+    result = []
+    for parent, values, extra in nodes:
+        node = new_tree(Tree)
+        node.id = next(newid)
+        node.children = []
+        node._cache = None
+        data = new_data(NodeData)
+        data.extra = extra
+        data._shared = False
+        data._node = None
+        node.data = data
+        word, lemma, label, morph, edge, num, parent_num = values
+        if word is not Ellipsis:
+            data.word = word
+        if lemma is not Ellipsis:
+            data.lemma = lemma if lemma is None else intern(lemma)
+        if label is not Ellipsis:
+            data.label = label if label is None else intern(label)
+        if morph is not Ellipsis:
+            data.morph = morph if morph is None else intern(morph)
+        if edge is not Ellipsis:
+            data.edge = edge if edge is None else intern(edge)
+        if num is not Ellipsis:
+            data.num = num
+        if parent_num is not Ellipsis:
+            data.parent_num = parent_num
+        if parent < 0:
+            node.parent = None
+        else:
+            node.parent = result[parent]
+            result[parent].children.append(node)
+        result.append(node)
+    return result[0]
+
+
+def _options(params):
+    """Return the options which determine the trees, as sorted tuple.
+    """
+    return tuple(sorted([(key, value) for key, value in params.items()
+                         if not key in IGNORED_OPTIONS]))
+
+
+def cache_file(reader_name, in_file, in_encoding, params):
+    """Return the name of the cache file for the given reader call.
+    """
+    key = repr((reader_name, in_encoding, _options(params)))
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+    return "%s.%s%s" % (in_file, digest, CACHE_SUFFIX)
+
+
+def _stamp(reader_name, in_file, in_encoding, params):
+    """Return the header of the cache file for the given reader call.
+    """
+    stat = os.stat(in_file)
+    return (CACHE_VERSION, reader_name, in_encoding, stat.st_size,
+            repr(stat.st_mtime), repr(_options(params)))
+
+
+def _cached_trees(reader, in_file, in_encoding, params):
+    """Generator yielding the trees from the cache file if it is up to
+    date, otherwise from the reader, while writing the cache file.
+    """
+    path = cache_file(reader.__name__, in_file, in_encoding, params)
+    stamp = _stamp(reader.__name__, in_file, in_encoding, params)
+    params = dict((key, value) for key, value in params.items()
+                  if not key == 'cache')
+    if params.get('symbols') is None:
+        params['symbols'] = trees.symbol_table()
+    symbols = params['symbols']
+    stream = None
+    try:
+        stream = open(path, 'rb')
+        up_to_date = marshal.load(stream) == stamp
+    except (IOError, EOFError, ValueError, TypeError):
+        up_to_date = False
+    if up_to_date:
+        if not 'quiet' in params:
+            print("reading from cache %s" % path, file=sys.stderr)
+        with stream:
+            while True:
+                try:
+                    nodes = marshal.load(stream)
+                except EOFError:
+                    break
+                yield load_tree(nodes, symbols)
+        return
+    if stream is not None:
+        stream.close()
+    temp_path = "%s.%d" % (path, os.getpid())
+    out = None
+    if not any([key in params for key in UNORDERED_OPTIONS]):
+        try:
+            out = open(temp_path, 'wb')
+            marshal.dump(stamp, out)
+        except IOError:
+            out = None
+    complete = False
+    try:
+        for tree in reader(in_file, in_encoding, **params):
+            if out is not None:
+                try:
+                    marshal.dump(dump_tree(tree), out)
+                except ValueError:
+                    # unmarshallable node data, give up caching
+                    out.close()
+                    os.remove(temp_path)
+                    out = None
+            yield tree
+        complete = True
+    finally:
+        if out is not None:
+            out.close()
+            if complete:
+                if os.path.exists(path):
+                    os.remove(path)
+                os.rename(temp_path, path)
+            else:
+                os.remove(temp_path)
+
+
+def cached(reader):
+    """Decorator for tree readers (see treeinput) which adds the cache
+    option.
+    """
+    @functools.wraps(reader)
+    def wrapper(in_file, in_encoding, **params):
+        if not 'cache' in params:
+            return reader(in_file, in_encoding, **params)
+        return _cached_trees(reader, in_file, in_encoding, params)
+    return wrapper
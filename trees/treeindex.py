@@ -0,0 +1,223 @@
+"""
+treetools: Tools for transforming treebank trees.
+
+This module provides random access to the sentences of treebank files.
+The byte offsets of all sentences (#BOS to #EOS in export, top-level
+brackets in bracketed formats, <s> elements in TIGER XML) are recorded
+in a sidecar index file which is rebuilt when the size or modification
+time of the treebank changes. Sentences are then read by seeking to their
+offset. The treebank must be uncompressed and in an ASCII-compatible
+encoding.
+
+Author: Wolfgang Maier <maierw@hhu.de>
+"""
+from __future__ import print_function
+import io
+import mmap
+import os
+import re
+import xml.etree.ElementTree as ET
+from . import trees, treeinput
+
+
+# file name suffix of the sidecar index
+INDEX_SUFFIX = ".idx"
+# first line of the index file, followed by format, size and mtime
+INDEX_HEADER = "treetools-index"
+# patterns for finding sentences
+EXPORT_SENTENCE = re.compile(br"^[ \t]*#BOS[ \t]+(\S+).*?^[ \t]*#EOS[^\n]*",
+                             re.MULTILINE | re.DOTALL)
+TIGERXML_SENTENCE = re.compile(br"<s[\s>].*?</s>", re.DOTALL)
+TIGERXML_ID = re.compile(br"\sid=\"([^\"]*)\"")
+TIGERXML_ENCODING = re.compile(br"^<\?xml[^>]*encoding=[\"']([^\"']+)[\"']")
+BRACKET_CHARACTER = re.compile(br"[()\n]")
+DIGITS = re.compile(br"\d+")
+
+
+def _export_offsets(data):
+    """Yield file id, offset and length of all sentences in export.
+    """
+    for match in EXPORT_SENTENCE.finditer(data):
+        yield int(match.group(1)), match.start(), match.end() - match.start()
+
+
+def _tigerxml_offsets(data):
+    """Yield file id, offset and length of all <s> elements in TIGER XML.
+    """
+    for match in TIGERXML_SENTENCE.finditer(data):
+        element = match.group()
+        xml_id = TIGERXML_ID.search(element, 0, element.find(b">"))
+        xml_id = DIGITS.findall(xml_id.group(1))[-1]
+        yield int(xml_id), match.start(), match.end() - match.start()
+
+
+def _bracket_offsets(data, disco):
+    """Yield position, offset and length of all top-level brackets. In
+    discobrackets, a sentence extends up to the end of the line after its
+    tree (the tokens might contain brackets).
+    """
+    position = 0
+    level = 0
+    start = None
+    tail = False
+    for match in BRACKET_CHARACTER.finditer(data):
+        character = match.group()
+        if tail:
+            if character == b"\n":
+                position += 1
+                yield position, start, match.start() - start
+                tail = False
+        elif character == b"(":
+            if level == 0:
+                start = match.start()
+            level += 1
+        elif character == b")" and level > 0:
+            level -= 1
+            if level == 0:
+                if disco:
+                    tail = True
+                else:
+                    position += 1
+                    yield position, start, match.end() - start
+    if tail:
+        position += 1
+        yield position, start, len(data) - start
+
+
+def build_index(in_file, in_format):
+    """Scan a treebank and return a list of (file id, offset, length)
+    triples, one per sentence. The file id is the #BOS number in export,
+    the last number of the id of the <s> element in TIGER XML, and the
+    position of the sentence (starting at 1) in bracketed formats.
+    """
+    if os.path.getsize(in_file) == 0:
+        return []
+    with io.open(in_file, mode='rb') as stream:
+        data = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if in_format == 'export':
+                return list(_export_offsets(data))
+            elif in_format == 'tigerxml':
+                return list(_tigerxml_offsets(data))
+            elif in_format in ['brackets', 'discobrackets']:
+                return list(_bracket_offsets(data,
+                                             in_format == 'discobrackets'))
+            raise ValueError("cannot index format %s" % in_format)
+        finally:
+            data.close()
+
+
+def _file_stamp(in_file, in_format):
+    """Return the header of the index file of a treebank.
+    """
+    stat = os.stat(in_file)
+    return "%s %s %d %r" % (INDEX_HEADER, in_format, stat.st_size,
+                            stat.st_mtime)
+
+
+def load_index(in_file, in_format):
+    """Return the index of a treebank (see build_index()). The sidecar
+    index file is read if it is up to date, otherwise the index is rebuilt
+    and written to the sidecar file (if possible).
+    """
+    stamp = _file_stamp(in_file, in_format)
+    index_file = in_file + INDEX_SUFFIX
+    try:
+        with io.open(index_file, encoding="utf-8") as stream:
+            if stream.readline().strip() == stamp:
+                return [tuple(int(field) for field in line.split())
+                        for line in stream]
+    except IOError:
+        pass
+    index = build_index(in_file, in_format)
+    try:
+        with io.open(index_file, mode="w", encoding="utf-8") as stream:
+            stream.write(u"%s\n" % stamp)
+            for entry in index:
+                stream.write(u"%d %d %d\n" % entry)
+    except IOError:
+        pass
+    return index
+
+
+class TreeIndex(object):
+    """Random access to the sentences of a treebank by sentence id. The
+    sentence ids are the ones the corresponding reader in treeinput would
+    assign with the same parameters ('continuous', 'brackets_firstid').
+    Sentences are returned in file order.
+    """
+    def __init__(self, in_file, in_encoding, in_format, **params):
+        if in_file.endswith(('.gz', '.bz2', '.xz')):
+            raise ValueError("cannot index compressed treebanks")
+        self.in_file = in_file
+        self.in_encoding = in_encoding
+        self.in_format = in_format
+        self.params = dict(params)
+        self.params.setdefault('symbols', trees.symbol_table())
+        self.offsets = {}
+        self.sids = []
+        firstid = params.get('brackets_firstid', 1)
+        for position, (file_id, offset, length) \
+                in enumerate(load_index(in_file, in_format)):
+            if in_format in ['brackets', 'discobrackets']:
+                sid = file_id + firstid - 1
+            elif 'continuous' in params:
+                sid = position + 1
+            else:
+                sid = file_id
+            self.offsets[sid] = (offset, length)
+            self.sids.append(sid)
+        if in_format == 'tigerxml':
+            with io.open(in_file, mode='rb') as stream:
+                match = TIGERXML_ENCODING.match(stream.read(1024))
+            self.in_encoding = "utf-8" if match is None \
+                else match.group(1).decode("ascii")
+
+    def __len__(self):
+        return len(self.sids)
+
+    def __contains__(self, sid):
+        return sid in self.offsets
+
+    def tree(self, sid):
+        """Read the sentence with the given id. Raise a KeyError if there
+        is no such sentence.
+        """
+        offset, length = self.offsets[sid]
+        with io.open(self.in_file, mode='rb') as stream:
+            stream.seek(offset)
+            text = stream.read(length).decode(self.in_encoding)
+        params = dict(self.params)
+        params['quiet'] = True
+        if self.in_format == 'export':
+            tree = treeinput.export_build_sentence(
+                [line.strip() for line in text.splitlines()[1:-1]], **params)
+        elif self.in_format == 'tigerxml':
+            s_element = ET.fromstring(text.encode("utf-8"))
+            tree = treeinput.tigerxml_build_tree(s_element, **params)
+            if 'replace_parens' in params:
+                for subtree in trees.preorder(tree):
+                    subtree = trees.replace_chars(subtree, trees.BRACKETS)
+        else:
+            params['brackets_firstid'] = sid
+            params['disco'] = self.in_format == 'discobrackets'
+            if params['disco'] and not text.endswith(u"\n"):
+                text += u"\n"
+            tree = next(treeinput.bracket_parser(io.StringIO(text),
+                                                 **params))
+        tree.data['sid'] = sid
+        return tree
+
+    def trees(self, sids):
+        """Generator yielding the sentences with the given ids.
+        """
+        for sid in sids:
+            yield self.tree(sid)
+
+    def range(self, first, last):
+        """Generator yielding all sentences with ids between first and
+        last (inclusive), in file order.
+        """
+        for sid in self.sids:
+            if first <= sid <= last:
+                yield self.tree(sid)
@@ -3,14 +3,21 @@ treetools: Tools for transforming treebank trees.
 
 This module handles reading of trees. Tree readers are implemented
 as generators reading from a file with a given encoding and yielding
-trees.
+trees. Labels, edges, morphological tags and lemmas are interned in a
+symbol table which is created per reader call (see trees.symbol_table()),
+unless a trees.SymbolTable is given with the symbols parameter.
+Compressed files (.gz, .bz2, .xz) are decompressed while reading.
 
 Author: Wolfgang Maier <maierw@hhu.de>
 """
 from __future__ import with_statement, print_function
-import io
+import functools
+import glob
+import itertools
+import marshal
+import multiprocessing
+import os
 import re
-import string
 import sys
 import xml.etree.ElementTree as ET
 from collections import defaultdict
@@ -18,7 +25,7 @@ if sys.version_info[0] < 3:
     from StringIO import StringIO
 else:
     from io import StringIO
-from . import trees, misc
+from . import trees, treecache, misc
 
 
 def tigerxml_build_tree(s_element, **params):
@@ -29,23 +36,24 @@ def tigerxml_build_tree(s_element, **params):
     gf_separator = trees.DEFAULT_GF_SEPARATOR
     if 'gf_separator' in params:
         gf_separator = params['gf_separator']
+    intern = trees.interner(params.get('symbols'))
     idref_to_tree = dict()
     # handle terminals
     term_cnt = 1
     for node in s_element.find('graph').find('terminals').findall('t'):
-        subtree = trees.Tree(trees.make_node_data())
+        subtree = trees.Tree()
         subtree.data['word'] = unicode(node.get('word'))
-        subtree.data['label'] = node.get('pos')
-        subtree.data['morph'] = node.get('morph')
-        subtree.data['lemma'] = node.get('lemma')
+        subtree.data['label'] = intern(node.get('pos'))
+        subtree.data['morph'] = intern(node.get('morph'))
+        subtree.data['lemma'] = intern(node.get('lemma'))
         subtree.data['edge'] = trees.DEFAULT_EDGE
         subtree.data['num'] = term_cnt
         term_cnt += 1
         idref_to_tree[node.get('id')] = subtree
     # handle non-terminals
     for node in s_element.find('graph').find('nonterminals').findall('nt'):
-        subtree = trees.Tree(trees.make_node_data())
-        subtree.data['label'] = node.get('cat')
+        subtree = trees.Tree()
+        subtree.data['label'] = intern(node.get('cat'))
         subtree.data['morph'] = trees.DEFAULT_MORPH
         subtree.data['edge'] = trees.DEFAULT_EDGE
         subtree.data['lemma'] = trees.DEFAULT_LEMMA
@@ -55,11 +63,10 @@ def tigerxml_build_tree(s_element, **params):
         subtree = idref_to_tree[node.get('id')]
         for edge in node.findall('edge'):
             child = idref_to_tree[edge.get('idref')]
-            child.data['edge'] = edge.get('label')
+            child.data['edge'] = intern(edge.get('label'))
             if child.parent is not None:
                 raise ValueError("more than one incoming edge for one node")
-            child.parent = subtree
-            subtree.children.append(child)
+            trees.add_child(subtree, child)
     root = None
     roots = []
     for subtree in idref_to_tree.values():
@@ -73,43 +80,83 @@ def tigerxml_build_tree(s_element, **params):
     root = roots[0]
     top = root
     if not root.data['label'] == trees.DEFAULT_ROOT:
-        top = trees.Tree(trees.make_node_data())
+        top = trees.Tree()
         top.data['label'] = trees.DEFAULT_ROOT
-        top.children.append(root)
         top.data['morph'] = trees.DEFAULT_MORPH
         top.data['edge'] = trees.DEFAULT_EDGE
         top.data['lemma'] = trees.DEFAULT_LEMMA
-        root.parent = top
+        trees.add_child(top, root)
     # split gf as postprocessing step if applicable
     if 'gf_split' in params:
         for subtree in trees.preorder(top):
             label_parts = trees.parse_label(subtree.data['label'], \
                                       gf_separator=gf_separator)
-            subtree.data['label'] = label_parts.label \
-                                    + label_parts.coindex \
-                                    + label_parts.headmarker
-            subtree.data['edge'] = label_parts.gf
+            subtree.data['label'] = intern(label_parts.label
+                                           + label_parts.coindex
+                                           + label_parts.headmarker)
+            subtree.data['edge'] = intern(label_parts.gf)
     return top
 
 
-def tigerxml(in_file, _, **params):
-    """Read trees from TIGER XML. The encoding argument is ignored here.
+def tigerxml_sentences(stream, keep=False):
+    """Generator which parses TIGER XML incrementally and yields the <s>
+    elements below <body> as soon as they are complete. Each element is
+    cleared and removed from the document after it has been consumed, so
+    memory usage does not grow with the size of the corpus. With keep, the
+    elements are only removed, not cleared, such that the caller can hold
+    on to them.
+    """
+    path = []
+    for event, element in ET.iterparse(stream, events=('start', 'end')):
+        if event == 'start':
+            path.append(element)
+        else:
+            path.pop()
+            if element.tag == 's' and len(path) > 0 \
+                    and path[-1].tag == 'body':
+                yield element
+                if not keep:
+                    element.clear()
+                path[-1].remove(element)
+
+
+def tigerxml_elements(stream, keep=False, **params):
+    """Generator yielding pairs of sentence id and <s> element from a
+    binary stream of TIGER XML, see tigerxml(). With keep, the XML is
+    parsed incrementally and the elements are left intact (see
+    tigerxml_sentences()).
     """
     digits = re.compile(r'\d+')
-    with io.open(in_file, mode='rb') as stream:
+    if keep or 'tigerxml_stream' in params:
+        s_elements = tigerxml_sentences(stream, keep)
+    else:
         if not 'quiet' in params:
             print("parsing xml...", file=sys.stderr)
         corpus = ET.parse(stream)
-        tree_cnt = 0
-        if not 'quiet' in params:
-            print("reading sentences", file=sys.stderr)
-        for s_element in corpus.getroot().find('body').findall('s'):
-            tree_cnt += 1
-            # take last number (assume there always is one)
-            xml_id = s_element.get('id')
-            xml_id = digits.findall(xml_id)[-1]
-            tree_id = tree_cnt if 'continuous' in params \
-                else int(xml_id)
+        s_elements = corpus.getroot().find('body').findall('s')
+    tree_cnt = 0
+    if not 'quiet' in params:
+        print("reading sentences", file=sys.stderr)
+    for s_element in s_elements:
+        tree_cnt += 1
+        # take last number (assume there always is one)
+        xml_id = s_element.get('id')
+        xml_id = digits.findall(xml_id)[-1]
+        tree_id = tree_cnt if 'continuous' in params \
+            else int(xml_id)
+        yield tree_id, s_element
+
+
+@treecache.cached
+def tigerxml(in_file, _, **params):
+    """Read trees from TIGER XML. The encoding argument is ignored here.
+    With tigerxml_stream, the XML is parsed incrementally and sentences
+    are yielded while reading, otherwise the whole document is parsed
+    first.
+    """
+    params.setdefault('symbols', trees.symbol_table())
+    with misc.open_input(in_file) as stream:
+        for tree_id, s_element in tigerxml_elements(stream, **params):
             try:
                 tree = tigerxml_build_tree(s_element, **params)
                 tree.data['sid'] = tree_id
@@ -123,44 +170,43 @@ def tigerxml(in_file, _, **params):
                           file=sys.stderr)
 
 
-def bracket_lexer(stream):
+# size of the blocks read by the bracket lexer
+BRACKET_LEXER_BLOCK_SIZE = 1 << 16
+# brackets, whitespace (as in string.whitespace) and remaining characters
+BRACKET_LEXER_PATTERN = re.compile(u"([()])|([\t\n\x0b\x0c\r ]+)|"
+                                   u"([^()\t\n\x0b\x0c\r ]+)")
+
+
+def bracket_lexer(stream, block_size=BRACKET_LEXER_BLOCK_SIZE):
     """Lexes input coming from stream in opening and closing brackets,
-    whitespace, and remaining characters. Works as generator."""
-    tokenbuf = StringIO()
-    whitespacebuf = StringIO()
-    character = stream.read(1)
-    while not character == "":
-        # holds tokens
-        tval = tokenbuf.getvalue()
-        # holds whitespace
-        wval = whitespacebuf.getvalue()
-        if len(tval) > 0 and len(wval) > 0:
-            raise ValueError("something went wrong in the lexer")
-        if character in trees.PHRASE_BRACKETS:
-            if len(tval) > 0:
-                yield tval, "TOKEN"
-                tokenbuf.close()
-                tokenbuf = StringIO()
-            if len(wval) > 0:
-                yield wval, "WS"
-                whitespacebuf.close()
-                whitespacebuf = StringIO()
-            yield character, trees.BRACKETS[character]
-        elif character in string.whitespace:
-            if len(tval) > 0:
-                yield tval, "TOKEN"
-                tokenbuf.close()
-                tokenbuf = StringIO()
-            whitespacebuf.write(character)
+    whitespace, and remaining characters. Works as generator. Input is
+    read in blocks which are tokenized with a regular expression."""
+    classes = [None, None, "WS", "TOKEN"]
+    rest = u""
+    block = stream.read(block_size)
+    while not block == "":
+        last = None
+        for match in BRACKET_LEXER_PATTERN.finditer(rest + block):
+            if last is not None:
+                yield last
+            token = match.group()
+            if match.lastindex == 1:
+                last = token, trees.BRACKETS[token]
+            else:
+                last = token, classes[match.lastindex]
+        # whitespace and tokens at the end of the block might continue
+        # in the next one
+        rest = u""
+        if last[1] in ["WS", "TOKEN"]:
+            rest = last[0]
         else:
-            if len(wval) > 0:
-                yield wval, "WS"
-                whitespacebuf.close()
-                whitespacebuf = StringIO()
-            tokenbuf.write(character)
-        character = stream.read(1)
+            yield last
+        block = stream.read(block_size)
+    # like the character-wise lexer, we discard whitespace and tokens
+    # which are not terminated before the end of the input
 
 
+@treecache.cached
 def brackets(in_file, in_encoding, **params):
     """Read bracketed trees with any kind of indentation by lexing
     input into whitespace, left/right brackets, and other tokens (aka
@@ -174,159 +220,310 @@ def brackets(in_file, in_encoding, **params):
        5   expect whitespace or left bracket or right bracket
            (next child or parent)
        9   expect possibly empty label (root label)
+    With brackets_lines (or brackets_jobs), no tree may span several
+    lines; the input is then read line by line, see bracket_lines().
     """
-    in_file = misc.gunzip(in_file)
-    gf_separator = trees.DEFAULT_GF_SEPARATOR
-    if 'gf_separator' in params:
-        gf_separator = params['gf_separator']
+    if not 'quiet' in params:
+        print("first sentence id will be %d" \
+              % params.get('brackets_firstid', 1))
+    params.setdefault('symbols', trees.symbol_table())
+    line_mode = 'brackets_lines' in params or 'brackets_jobs' in params
+    with misc.open_input(in_file, in_encoding) as stream:
+        if line_mode and not params.get('disco', False):
+            parser = bracket_lines(stream, **params)
+        else:
+            parser = bracket_parser(stream, **params)
+        for tree in parser:
+            yield tree
+
+
+def bracket_label(token, **params):
+    """Return label and edge (not interned) of a phrase label token in
+    bracketed input, splitting off the grammatical function with gf_split.
+    """
+    if not 'gf_split' in params:
+        return token, trees.DEFAULT_EDGE
+    gf_separator = params.get('gf_separator', trees.DEFAULT_GF_SEPARATOR)
+    label_parts = trees.parse_label(token, gf_separator=gf_separator)
+    separator = gf_separator
+    if len(label_parts.coindex) == 0:
+        separator = ""
+    label = label_parts.label + separator + label_parts.coindex \
+        + label_parts.headmarker
+    return label, label_parts.gf
+
+
+# tokens of a line of bracketed input
+BRACKET_LINE_PATTERN = re.compile(u"[()]|[^()\t\n\x0b\x0c\r ]+")
+# number of lines per job with brackets_jobs
+BRACKET_LINES_CHUNK_SIZE = 1000
+
+
+def bracket_parse_line(line, **params):
+    """Parse a line of bracketed input and return the list of trees in
+    it (usually one), without sentence ids. The line is split into brackets
+    and tokens with a single regular expression and parsed with a stack of
+    open phrases; the trees are the same as the ones of bracket_parser().
+    Raise a ValueError if a tree is not closed at the end of the line.
+    """
+    intern = trees.interner(params.get('symbols'))
+    Tree = trees.Tree
+    result = []
+    # open phrases and whether they already have a word or children
+    stack = []
+    filled = []
+    expect_label = False
+    term_cnt = 1
+    for token in BRACKET_LINE_PATTERN.findall(line):
+        if token == u"(":
+            if expect_label:
+                if len(stack) > 1:
+                    raise ValueError("expected whitespace or label, got (")
+                # empty root label (PTB style)
+                stack[-1].data['label'] = trees.DEFAULT_ROOT
+            elif stack and filled[-1] == 'word':
+                raise ValueError("expected whitespace or ), got (")
+            if stack:
+                filled[-1] = 'children'
+            stack.append(Tree())
+            filled.append(None)
+            expect_label = True
+        elif token == u")":
+            if not stack:
+                continue
+            if expect_label:
+                if len(stack) > 1:
+                    raise ValueError("expected label, got )")
+                raise ValueError("expected whitespace, label or (, got )")
+            node = stack.pop()
+            if filled.pop() is None:
+                if not 'brackets_emptypos' in params:
+                    raise ValueError("expected whitespace or (, got )")
+                if not 'quiet' in params:
+                    print("got empty POS", file=sys.stderr)
+                node.data['word'] = node.data['label']
+                node.data['label'] = trees.DEFAULT_LABEL
+                node.data['edge'] = trees.DEFAULT_EDGE
+                node.data['morph'] = trees.DEFAULT_MORPH
+                node.data['num'] = term_cnt
+                term_cnt += 1
+            if stack:
+                trees.add_child(stack[-1], node)
+            else:
+                if 'replace_parens' in params:
+                    for subtree in trees.preorder(node):
+                        subtree = trees.replace_chars(subtree, trees.BRACKETS)
+                result.append(node)
+                term_cnt = 1
+        elif not stack:
+            continue
+        elif expect_label:
+            label, edge = bracket_label(token, **params)
+            data = stack[-1].data
+            data['label'] = intern(label)
+            data['edge'] = intern(edge)
+            data['morph'] = trees.DEFAULT_MORPH
+            expect_label = False
+        elif filled[-1] is None:
+            stack[-1].data['word'] = token
+            stack[-1].data['num'] = term_cnt
+            term_cnt += 1
+            filled[-1] = 'word'
+        elif filled[-1] == 'word':
+            raise ValueError("expected whitespace or ), got token")
+        else:
+            raise ValueError("expected whitespace, ( or ), got token")
+    if stack:
+        raise ValueError("tree not closed at end of line")
+    return result
+
+
+def _bracket_parse_lines(job):
+    """Parse a chunk of lines in a worker process, see bracket_lines().
+    The trees are returned serialized with marshal (see
+    treecache.dump_tree()), which, unlike pickling, works at any tree
+    depth.
+    """
+    lines, params = job
+    return marshal.dumps([treecache.dump_tree(tree) for line in lines
+                          for tree in bracket_parse_line(line, **params)])
+
+
+def bracket_lines(stream, **params):
+    """Parse bracketed trees from a stream of text in which no tree spans
+    several lines, see brackets() and bracket_parse_line(). With
+    brackets_jobs, chunks of lines are parsed by that many worker
+    processes; the trees are yielded in input order. Inside a worker
+    process (e.g. with --jobs), the lines are parsed sequentially.
+    """
+    sid = params.get('brackets_firstid', 1)
+    jobs = params.get('brackets_jobs', 1)
+    # processes of a pool cannot start their own workers
+    if jobs > 1 and not multiprocessing.current_process().daemon:
+        symbols = params.get('symbols')
+        worker_params = dict((key, value) for key, value in params.items()
+                             if not key == 'symbols')
+        chunks = ((lines, worker_params) for lines in
+                  iter(lambda: list(itertools.islice(
+                      stream, BRACKET_LINES_CHUNK_SIZE)), []))
+        pool = multiprocessing.Pool(jobs)
+        try:
+            for result in pool.imap(_bracket_parse_lines, chunks):
+                for nodes in marshal.loads(result):
+                    tree = treecache.load_tree(nodes, symbols)
+                    tree.data['sid'] = sid
+                    sid += 1
+                    yield tree
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        for line in stream:
+            for tree in bracket_parse_line(line, **params):
+                tree.data['sid'] = sid
+                sid += 1
+                yield tree
+
+
+def bracket_parser(stream, **params):
+    """Parse bracketed trees from a stream of text, see brackets().
+    """
+    intern = trees.interner(params.get('symbols'))
     cnt = 1
     if 'brackets_firstid' in params:
         cnt = params['brackets_firstid']
-    if not 'quiet' in params:
-        print("first sentence id will be %d" % cnt)
     queue = []
     state = 0
     level = 0
     term_cnt = 1
-    with io.open(in_file, encoding=in_encoding) as stream:
-        lexer = bracket_lexer(stream)
-        for lextoken, lexclass in lexer:
-            if lexclass == "LRB":
-                if state in [0, 2, 3, 5]:
-                    # beginning of sentence or phrase
-                    level += 1
-                    queue.append(trees.Tree(trees.make_node_data()))
-                    state = 9 if state == 0 else 1
-                elif state == 9:
-                    # happens when root label is empty (PTB style)
-                    level += 1
-                    queue[-1].data['label'] = trees.DEFAULT_ROOT
-                    queue.append(trees.Tree(trees.make_node_data()))
-                    state = 1
-                elif state == 1:
-                    raise ValueError("expected whitespace or label, got (")
-                elif state == 4:
-                    raise ValueError("expected whitespace or ), got (")
-                else:
-                    raise ValueError("unknown state")
-            elif lexclass == "RRB":
-                if state in [0]:
-                    pass
-                elif state in [2, 4, 5]:
-                    if state == 2:
-                        if not 'brackets_emptypos' in params:
-                            raise ValueError("expected whitespace or (, got )")
+    lexer = bracket_lexer(stream)
+    for lextoken, lexclass in lexer:
+        if lexclass == "LRB":
+            if state in [0, 2, 3, 5]:
+                # beginning of sentence or phrase
+                level += 1
+                queue.append(trees.Tree())
+                state = 9 if state == 0 else 1
+            elif state == 9:
+                # happens when root label is empty (PTB style)
+                level += 1
+                queue[-1].data['label'] = trees.DEFAULT_ROOT
+                queue.append(trees.Tree())
+                state = 1
+            elif state == 1:
+                raise ValueError("expected whitespace or label, got (")
+            elif state == 4:
+                raise ValueError("expected whitespace or ), got (")
+            else:
+                raise ValueError("unknown state")
+        elif lexclass == "RRB":
+            if state in [0]:
+                pass
+            elif state in [2, 4, 5]:
+                if state == 2:
+                    if not 'brackets_emptypos' in params:
+                        raise ValueError("expected whitespace or (, got )")
+                    else:
+                        if not 'quiet' in params:
+                            print("got empty POS", file=sys.stderr)
+                        # last token was a word
+                        queue[-1].data['word'] = queue[-1].data['label']
+                        # queue[-1].data['label'] = queue[-2].data['label']
+                        queue[-1].data['label'] = trees.DEFAULT_LABEL
+                        queue[-1].data['edge'] = trees.DEFAULT_EDGE
+                        queue[-1].data['morph'] = trees.DEFAULT_MORPH
+                        queue[-1].data['num'] = term_cnt
+                        term_cnt += 1
+                level -= 1
+                if len(queue) > 1:
+                    # close phrase
+                    trees.add_child(queue[-2], queue[-1])
+                    queue.pop()
+                if level == 0:
+                    # close sentence
+                    queue[0].data['sid'] = cnt
+                    cnt += 1
+                    if 'replace_parens' in params:
+                        for subtree in trees.preorder(queue[0]):
+                            subtree = trees.replace_chars(subtree,
+                                                          trees.BRACKETS)
+                    if 'disco' in params and params['disco']:
+                        terminalmap = {}
+                        for terminal in trees.terminals(queue[0]):
+                            terminalmap[int(terminal.data['word'])] = terminal
+                        tokenmap = defaultdict(int)
+                        position = 1
+                        try:
+                            lextoken, lexclass = lexer.next()
+                        except StopIteration:
+                            raise ValueError("no sentence after tree")
+                        try:
+                            while not lextoken == "\n":
+                                lextoken, lexclass = lexer.next()
+                                if not lextoken == ' ':
+                                    tokenmap[position] = lextoken
+                                    position += 1
+                        except StopIteration:
+                            pass
+                        if 'disco_reordered' in params:
+                            for terminal in trees.terminals(queue[0]):
+                                terminal.data['word'] = terminal.data['word'] + "-" \
+                                    + tokenmap[terminal.data['num']]
                         else:
-                            if not 'quiet' in params:
-                                print("got empty POS", file=sys.stderr)
-                            # last token was a word
-                            queue[-1].data['word'] = queue[-1].data['label']
-                            # queue[-1].data['label'] = queue[-2].data['label']
-                            queue[-1].data['label'] = trees.DEFAULT_LABEL
-                            queue[-1].data['edge'] = trees.DEFAULT_EDGE
-                            queue[-1].data['morph'] = trees.DEFAULT_MORPH
-                            queue[-1].data['num'] = term_cnt
-                            term_cnt += 1
-                    level -= 1
-                    if len(queue) > 1:
-                        # close phrase
-                        queue[-2].children.append(queue[-1])
-                        queue[-1].parent = queue[-2]
-                        queue.pop()
-                    if level == 0:
-                        # close sentence
-                        queue[0].data['sid'] = cnt
-                        cnt += 1
-                        if 'replace_parens' in params:
-                            for subtree in trees.preorder(queue[0]):
-                                subtree = trees.replace_chars(subtree,
-                                                              trees.BRACKETS)
-                        if 'disco' in params and params['disco']:
-                            terminalmap = {}
                             for terminal in trees.terminals(queue[0]):
-                                terminalmap[int(terminal.data['word'])] = terminal
-                            tokenmap = defaultdict(int)
-                            position = 1
-                            try:
-                                lextoken, lexclass = lexer.next()
-                            except StopIteration:
-                                raise ValueError("no sentence after tree")
-                            try:
-                                while not lextoken == "\n":
-                                    lextoken, lexclass = lexer.next()
-                                    if not lextoken == ' ':
-                                        tokenmap[position] = lextoken
-                                        position += 1
-                            except StopIteration:
-                                pass
-                            if 'disco_reordered' in params:
-                                for terminal in trees.terminals(queue[0]):
-                                    terminal.data['word'] = terminal.data['word'] + "-" \
-                                        + tokenmap[terminal.data['num']]
-                            else:
-                                for terminal in trees.terminals(queue[0]):
-                                    terminal.data['num'] = int(terminal.data['word']) + 1
-                                    terminal.data['word'] = tokenmap[terminal.data['num']]
-                        yield queue[0]
-                        term_cnt = 1
-                        queue = []
-                        state = 0
-                    else:
-                        state = 5
-                elif state == 1:
-                    raise ValueError("expected label, got )")
-                elif state in [3, 9]:
-                    raise ValueError("expected whitespace, label or (, got )")
-                else:
-                    raise ValueError("unknown state")
-            elif lexclass == "WS":
-                if state in [0, 1, 3, 4, 5, 9]:
-                    pass
-                elif state == 2:
-                    # only don't skip whitespace if it's then one between POS
-                    # and word
-                    state = 3
-                else:
-                    raise ValueError("unknown state")
-            elif lexclass == "TOKEN":
-                if state == 0:
-                    pass
-                elif state in [1, 9]:
-                    # phrase label, 9 when root label, 1 otherwise
-                    if 'gf_split' in params:
-                        label_parts = trees.parse_label(lextoken,
-                                                  gf_separator=gf_separator)
-                        separator = gf_separator
-                        if len(label_parts.coindex) == 0:
-                            separator = ""
-                        label = label_parts.label + separator \
-                                + label_parts.coindex \
-                                + label_parts.headmarker
-                        edge = label_parts.gf
-                    else:
-                        label = lextoken
-                        edge = trees.DEFAULT_EDGE
-                    queue[-1].data['label'] = label
-                    queue[-1].data['edge'] = edge
-                    queue[-1].data['morph'] = trees.DEFAULT_MORPH
-                    state = 2
-                elif state == 3:
-                    queue[-1].data['word'] = lextoken
-                    queue[-1].data['num'] = term_cnt
-                    term_cnt += 1
-                    state = 4
-                elif state == 2:
-                    raise ValueError("expected whitespace or (, got token")
-                elif state == 4:
-                    raise ValueError("expected whitespace or ), got token")
-                elif state == 5:
-                    raise ValueError("expected whitespace, ( or ), got token")
+                                trees.set_num(terminal,
+                                              int(terminal.data['word']) + 1)
+                                terminal.data['word'] = tokenmap[terminal.data['num']]
+                    yield queue[0]
+                    term_cnt = 1
+                    queue = []
+                    state = 0
                 else:
-                    raise ValueError("unknown state")
+                    state = 5
+            elif state == 1:
+                raise ValueError("expected label, got )")
+            elif state in [3, 9]:
+                raise ValueError("expected whitespace, label or (, got )")
+            else:
+                raise ValueError("unknown state")
+        elif lexclass == "WS":
+            if state in [0, 1, 3, 4, 5, 9]:
+                pass
+            elif state == 2:
+                # only don't skip whitespace if it's then one between POS
+                # and word
+                state = 3
+            else:
+                raise ValueError("unknown state")
+        elif lexclass == "TOKEN":
+            if state == 0:
+                pass
+            elif state in [1, 9]:
+                # phrase label, 9 when root label, 1 otherwise
+                label, edge = bracket_label(lextoken, **params)
+                queue[-1].data['label'] = intern(label)
+                queue[-1].data['edge'] = intern(edge)
+                queue[-1].data['morph'] = trees.DEFAULT_MORPH
+                state = 2
+            elif state == 3:
+                queue[-1].data['word'] = lextoken
+                queue[-1].data['num'] = term_cnt
+                term_cnt += 1
+                state = 4
+            elif state == 2:
+                raise ValueError("expected whitespace or (, got token")
+            elif state == 4:
+                raise ValueError("expected whitespace or ), got token")
+            elif state == 5:
+                raise ValueError("expected whitespace, ( or ), got token")
             else:
-                raise ValueError("unknown lexer token class")
+                raise ValueError("unknown state")
+        else:
+            raise ValueError("unknown lexer token class")
 
 
+@treecache.cached
 def discobrackets(in_file, in_encoding, **params):
     """ Build a tree from disco bracket input. Every terminal is supposed to
     be an integer i. For a sentence of length n, all 1 <= i <= n must be
@@ -342,32 +539,12 @@ def discobrackets(in_file, in_encoding, **params):
         yield tree
 
 
-def export_build_tree(num, node_by_num, children_by_num):
-    """ Build a tree from export. """
-    tree = trees.Tree(node_by_num[num])
-    tree.data['terminals'] = []
-    if num in children_by_num:
-        tree.children = []
-        for child in children_by_num[num]:
-            child_tree = export_build_tree(child, node_by_num, children_by_num)
-            child_tree.parent = tree
-            tree.children.append(child_tree)
-            tree.data['terminals'].extend(child_tree.data['terminals'])
-        tree.children = sorted(tree.children, \
-                                    key=lambda x: min(x.data['terminals']))
-    else:
-        tree.children = []
-        tree.data['terminals'] = [num]
-        tree.data['num'] = num
-    tree.data['terminals'] = sorted(tree.data['terminals'])
-    return tree
-
-
 def export_parse_line(line, **params):
     """ Parse a single export format line, i.e., one node."""
     gf_separator = trees.DEFAULT_GF_SEPARATOR
     if 'gf_separator' in params:
         gf_separator = params['gf_separator']
+    intern = trees.interner(params.get('symbols'))
     fields = line.split()
     # if it is export 3, insert dummy lemma
     if fields[4].isdigit():
@@ -389,64 +566,366 @@ def export_parse_line(line, **params):
         fields['label'] = label_parts.label + separator + \
             label_parts.coindex + label_parts.headmarker
         fields['edge'] = label_parts.gf
+    for field in ['lemma', 'label', 'morph', 'edge']:
+        fields[field] = intern(fields[field])
     return fields
 
 
-def export(in_file, in_encoding, **params):
-    """Read export format (3 or 4). Ignores all fields after the parent number
-    since not all export treebanks respect the original export definition
-    from Brants (1997) (see TueBa-D/Z 8).
+def export_build_sentence(lines, **params):
+    """Build a tree from the (stripped) node lines of a sentence, i.e.,
+    the lines between #BOS and #EOS, in a single pass. Nodes are linked
+    afterwards by visiting the terminals from left to right and walking
+    up from each of them until an already linked node is reached. Every
+    node is thereby appended to its parent when its leftmost terminal is
+    visited, i.e., children come out ordered without sorting.
+    """
+    root_data = trees.make_node_data()
+    root_data['label'] = trees.DEFAULT_ROOT
+    root_data['edge'] = trees.DEFAULT_EDGE
+    tree = trees.Tree(root_data)
+    node_by_num = {0 : tree}
+    terminals = []
+    term_cnt = 1
+    for line in lines:
+        node = trees.Tree(export_parse_line(line, **params))
+        word = node.data['word']
+        if len(word) == 4 and word[0] == u"#" and word[1:].isdigit():
+            num = int(word[1:])
+        else:
+            num = term_cnt
+            term_cnt += 1
+            node.data['num'] = num
+            terminals.append(num)
+        if not 0 <= num <= 999:
+            raise ValueError("node number must 0 and 999")
+        node_by_num[num] = node
+    # non-terminals without children are terminals numbered like the node
+    parent_nums = set([node.data['parent_num'] for node
+                       in node_by_num.values() if node is not tree])
+    for num in sorted(set(node_by_num) - parent_nums - set(terminals)):
+        node_by_num[num].data['num'] = num
+        terminals.append(num)
+    linked = set([0])
+    for num in terminals:
+        while not num in linked:
+            linked.add(num)
+            node = node_by_num[num]
+            num = node.data['parent_num']
+            if not num in node_by_num:
+                raise ValueError("unknown parent number %d" % num)
+            # nodes are new and have no cache, no need for add_child()
+            node.parent = node_by_num[num]
+            node.parent.children.append(node)
+    if 'replace_parens' in params:
+        for subtree in trees.preorder(tree):
+            subtree = trees.replace_chars(subtree, trees.BRACKETS)
+    return tree
+
+
+def export_sentence_lines(lines):
+    """Generator which groups an iterable of export lines into sentences
+    and yields pairs of #BOS number and (stripped) node lines.
     """
-    in_file = misc.gunzip(in_file)
     in_sentence = False
     sentence = []
     last_id = None
+    for line in lines:
+        line = line.strip()
+        if not in_sentence:
+            if line.startswith(u"#BOS"):
+                last_id = int(line.split()[1])
+                in_sentence = True
+                sentence.append(line)
+        else:
+            sentence.append(line)
+            if line.startswith(u"#EOS"):
+                yield last_id, sentence[1:-1]
+                in_sentence = False
+                sentence = []
+
+
+def export_sentences(lines, **params):
+    """Generator which reads the sentences from an iterable of export lines
+    and yields pairs of #BOS number and tree.
+    """
+    for last_id, sentence in export_sentence_lines(lines):
+        yield last_id, export_build_sentence(sentence, **params)
+
+
+def export_shards(in_file, count):
+    """Split an export file into at most count byte ranges which start
+    at #BOS lines (the first one at the beginning of the file). Return a
+    list of (start, end) offsets.
+    """
+    size = os.path.getsize(in_file)
+    bounds = [0]
+    with open(in_file, 'rb') as stream:
+        for i in range(1, count):
+            stream.seek(max(size * i // count - 1, bounds[-1]))
+            # skip to the beginning of the next line
+            stream.readline()
+            offset = stream.tell()
+            line = stream.readline()
+            while line and not line.strip().startswith(b"#BOS"):
+                offset = stream.tell()
+                line = stream.readline()
+            if not line:
+                break
+            if offset > bounds[-1]:
+                bounds.append(offset)
+    bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
+
+
+def _export_shard(job):
+    """Parse the sentences in a byte range of an export file (to be run
+    in a worker process). Return a list of pairs of #BOS number and tree,
+    serialized with marshal (see treecache.dump_tree()), which, unlike
+    pickling, works at any tree depth.
+    """
+    in_file, in_encoding, start, end, params = job
+    with open(in_file, 'rb') as stream:
+        stream.seek(start)
+        lines = iter(stream.readline, b"")
+        lines = (line.decode(in_encoding) for line
+                 in itertools.takewhile(lambda _: stream.tell() <= end,
+                                        lines))
+        return marshal.dumps([(last_id, treecache.dump_tree(tree))
+                              for last_id, tree
+                              in export_sentences(lines, **params)])
+
+
+def _export_parallel(in_file, in_encoding, **params):
+    """Parse an export file with params['export_jobs'] worker processes,
+    see export().
+    """
+    jobs = params['export_jobs']
+    symbols = params.get('symbols')
+    worker_params = dict((key, value) for key, value in params.items()
+                         if not key == 'symbols')
+    shards = [(in_file, in_encoding, start, end, worker_params)
+              for start, end in export_shards(in_file, jobs * 4)]
+    pool = multiprocessing.Pool(jobs)
+    try:
+        if 'export_unordered' in params:
+            results = pool.imap_unordered(_export_shard, shards)
+        else:
+            results = pool.imap(_export_shard, shards)
+        for result in results:
+            for last_id, nodes in marshal.loads(result):
+                yield last_id, treecache.load_tree(nodes, symbols)
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+@treecache.cached
+def export(in_file, in_encoding, **params):
+    """Read export format (3 or 4). Ignores all fields after the parent number
+    since not all export treebanks respect the original export definition
+    from Brants (1997) (see TueBa-D/Z 8). With export_jobs, uncompressed
+    files are split at #BOS lines and parsed by several processes; trees
+    are yielded in the original order unless export_unordered is given
+    (then, with continuous, sentence ids follow the output order).
+    Inside a worker process (e.g. with --jobs), export_jobs is ignored.
+    """
+    params.setdefault('symbols', trees.symbol_table())
     tree_cnt = 1
-    with io.open(in_file, encoding=in_encoding) as stream:
-        for line in stream:
-            line = line.strip()
-            if not in_sentence:
-                if line.startswith(u"#BOS"):
-                    last_id = int(line.split()[1])
-                    in_sentence = True
-                    sentence.append(line)
+    # processes of a pool cannot start their own workers
+    if params.get('export_jobs', 1) > 1 \
+            and not multiprocessing.current_process().daemon \
+            and not in_file.endswith(('.gz', '.bz2', '.xz')):
+        sentences = _export_parallel(in_file, in_encoding, **params)
+        for last_id, tree in sentences:
+            tree.data['sid'] = tree_cnt if 'continuous' in params \
+                else last_id
+            yield tree
+            tree_cnt += 1
+    else:
+        with misc.open_input(in_file, in_encoding) as stream:
+            for last_id, tree in export_sentences(stream, **params):
+                tree.data['sid'] = tree_cnt if 'continuous' in params \
+                    else last_id
+                yield tree
+                tree_cnt += 1
+
+
+class SentenceRecord(object):
+    """A sentence as read from a treebank, before the tree is built. It
+    holds the sentence id, the raw sentence (node lines for export, text
+    for brackets, <s> element detached from the document for TIGER XML)
+    and the number of tokens. The tree is built on first access of the tree attribute.
+    """
+    __slots__ = ('sid', 'raw', 'token_count', '_build', '_tree')
+
+    def __init__(self, sid, raw, token_count, build):
+        self.sid = sid
+        self.raw = raw
+        self.token_count = token_count
+        self._build = build
+        self._tree = None
+
+    @property
+    def tree(self):
+        """The tree of the sentence.
+        """
+        if self._tree is None:
+            self._tree = self._build(self.raw, self.sid)
+            self._tree.data['sid'] = self.sid
+        return self._tree
+
+
+def _export_record_tree(params, lines, _):
+    """Build the tree of an export sentence record.
+    """
+    return export_build_sentence(lines, **params)
+
+
+def _bracket_record_tree(params, text, sid):
+    """Build the tree of a bracket sentence record.
+    """
+    params = dict(params, brackets_firstid=sid, quiet=True)
+    return next(bracket_parser(StringIO(text + u"\n"), **params))
+
+
+def _tigerxml_record_tree(params, s_element, _):
+    """Build the tree of a TIGER XML sentence record.
+    """
+    tree = tigerxml_build_tree(s_element, **params)
+    if 'replace_parens' in params:
+        for subtree in trees.preorder(tree):
+            subtree = trees.replace_chars(subtree, trees.BRACKETS)
+    return tree
+
+
+def bracket_sentence_texts(stream, disco=False):
+    """Generator which splits bracketed input into sentences and yields
+    pairs of sentence text and number of terminals (brackets without
+    bracketed children). In discobrackets, the text extends to the end of
+    the line after the tree.
+    """
+    tokens = []
+    # for each open bracket: does it have bracketed children?
+    has_children = []
+    terminal_cnt = 0
+    tail = False
+    for lextoken, lexclass in bracket_lexer(stream):
+        if tail:
+            if lexclass == "WS" and u"\n" in lextoken:
+                yield u"".join(tokens), terminal_cnt
+                tokens = []
+                terminal_cnt = 0
+                tail = False
             else:
-                sentence.append(line)
-                if line.startswith(u"#EOS"):
-                    node_by_num = {}
-                    children_by_num = {}
-                    node_by_num[0] = trees.make_node_data()
-                    node_by_num[0]['label'] = trees.DEFAULT_ROOT
-                    node_by_num[0]['edge'] = trees.DEFAULT_EDGE
-                    term_cnt = 1
-                    for fields in [export_parse_line(line, **params) \
-                                       for line in sentence[1:-1]]:
-                        word = fields['word']
-                        num = None
-                        if len(word) == 4 and word[0] == u"#" \
-                                and word[1:].isdigit():
-                            num = int(word[1:])
-                        else:
-                            num = term_cnt
-                            term_cnt += 1
-                        if not 0 <= num <= 999:
-                            raise ValueError("node number must 0 and 999")
-                        node_by_num[num] = fields
-                        if not fields['parent_num'] in children_by_num:
-                            children_by_num[fields['parent_num']] = []
-                        children_by_num[fields['parent_num']].append(num)
-                    tree = export_build_tree(0, node_by_num, children_by_num)
-                    tree.data['sid'] = tree_cnt if 'continuous' in params \
-                        else last_id
-                    if 'replace_parens' in params:
-                        for subtree in trees.preorder(tree):
-                            subtree = trees.replace_chars(subtree,
-                                                          trees.BRACKETS)
-                    yield tree
-                    term_cnt = 1
-                    tree_cnt += 1
-                    in_sentence = False
-                    sentence = []
+                tokens.append(lextoken)
+            continue
+        if len(has_children) > 0 or lexclass == "LRB":
+            tokens.append(lextoken)
+        if lexclass == "LRB":
+            if len(has_children) > 0:
+                has_children[-1] = True
+            has_children.append(False)
+        elif lexclass == "RRB" and len(has_children) > 0:
+            if not has_children.pop():
+                terminal_cnt += 1
+            if len(has_children) == 0:
+                if disco:
+                    tail = True
+                else:
+                    yield u"".join(tokens), terminal_cnt
+                    tokens = []
+                    terminal_cnt = 0
+    if tail:
+        yield u"".join(tokens), terminal_cnt
+
+
+def records(in_file, in_encoding, in_format, **params):
+    """Generator which reads a treebank in the given input format and
+    yields a SentenceRecord per sentence, with the sentence ids the tree
+    reader would assign. Trees are only built when they are accessed.
+    TIGER XML is always parsed incrementally.
+    """
+    build_params = dict(params)
+    build_params.setdefault('symbols', trees.symbol_table())
+    if in_format == 'export':
+        build = functools.partial(_export_record_tree, build_params)
+        tree_cnt = 1
+        with misc.open_input(in_file, in_encoding) as stream:
+            for last_id, lines in export_sentence_lines(stream):
+                token_count = 0
+                for line in lines:
+                    word = line.split(None, 1)[0] if line else u""
+                    if not (len(word) == 4 and word[0] == u"#"
+                            and word[1:].isdigit()):
+                        token_count += 1
+                sid = tree_cnt if 'continuous' in params else last_id
+                yield SentenceRecord(sid, lines, token_count, build)
+                tree_cnt += 1
+    elif in_format in ['brackets', 'discobrackets']:
+        disco = in_format == 'discobrackets'
+        build_params['disco'] = disco
+        build = functools.partial(_bracket_record_tree, build_params)
+        sid = params.get('brackets_firstid', 1)
+        with misc.open_input(in_file, in_encoding) as stream:
+            for text, token_count in bracket_sentence_texts(stream, disco):
+                yield SentenceRecord(sid, text, token_count, build)
+                sid += 1
+    elif in_format == 'tigerxml':
+        build = functools.partial(_tigerxml_record_tree, build_params)
+        with misc.open_input(in_file) as stream:
+            for sid, s_element in tigerxml_elements(stream, True,
+                                                    **params):
+                token_count = len(s_element.find('graph').find('terminals'))
+                yield SentenceRecord(sid, s_element, token_count, build)
+    else:
+        raise ValueError("unknown input format %s" % in_format)
+
+
+def count_sentences(in_file, in_encoding, in_format, **params):
+    """Return the number of sentences of a treebank without building trees.
+    TIGER XML is parsed incrementally and only the <s> elements are
+    counted, other formats are counted on the sentence records (see
+    records()).
+    """
+    if in_format == 'tigerxml':
+        with misc.open_input(in_file) as stream:
+            return sum(1 for _ in tigerxml_sentences(stream))
+    params = dict(params, quiet=True)
+    count = 0
+    for _ in records(in_file, in_encoding, in_format, **params):
+        count += 1
+    return count
+
+
+# glob pattern characters in input names
+INPUT_PATTERN = re.compile(r"[*?[]")
+# files in input directories which are skipped: sidecar files of treeindex
+# and treecache, output of transform
+IGNORED_INPUT = re.compile(r"\.(idx|cache|cache\.\d+|dest)$")
+
+
+def is_multiple_input(src):
+    """Return true if src is a directory or a glob pattern.
+    """
+    return os.path.isdir(src) or INPUT_PATTERN.search(src) is not None
+
+
+def input_files(src):
+    """Return the list of input files given by src, which is either a
+    single file, a directory (all files in it are read) or a glob pattern.
+    Files are ordered by size, largest first, such that the longest jobs are
+    scheduled first when they are processed in parallel.
+    """
+    if not is_multiple_input(src):
+        return [src]
+    if os.path.isdir(src):
+        files = [os.path.join(src, name) for name in os.listdir(src)]
+    else:
+        files = glob.glob(src)
+    files = [name for name in files if os.path.isfile(name)
+             and IGNORED_INPUT.search(name) is None]
+    return sorted(files, key=os.path.getsize, reverse=True)
 
 
 INPUT_FORMATS = [export, brackets, discobrackets, tigerxml]
@@ -458,7 +937,18 @@ INPUT_OPTIONS = {'disco_reordered' : 'In discobrackets, output CF order with '\
                      ' gf option (default %s)' % trees.DEFAULT_GF_SEPARATOR,
                  'brackets_emptypos' : 'Brackets: Allow empty POS tags',
                  'brackets_firstid' : 'Brackets: Give first tree id [ID]',
+                 'brackets_lines' : 'Brackets: One or more trees per line, ' \
+                     'no tree spans several lines (faster parsing)',
+                 'brackets_jobs' : 'Brackets: Parse lines with [N] processes ' \
+                     '(implies brackets_lines)',
                  'continuous' : 'Export/TIGERXML: number sentences by ' \
                      'counting, don\'t use #BOS',
                  'replace_parens' : 'Replace parens by LRB, RRB, etc. ',
+                 'tigerxml_stream' : 'TIGERXML: Parse incrementally, ' \
+                     'yield sentences while reading',
+                 'cache' : 'Keep a binary cache of the parsed trees ' \
+                     'next to the input file and use it in later runs',
+                 'export_jobs' : 'Export: Parse with [N] processes',
+                 'export_unordered' : 'Export: With export_jobs, yield ' \
+                     'trees in the order in which they are parsed',
                  'quiet' : 'no messages while reading'}
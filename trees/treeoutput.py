@@ -6,10 +6,16 @@ This module handles tree writing in different formats.
 Author: Wolfgang Maier <maierw@hhu.de>
 """
 from __future__ import division, print_function
+import codecs
+import io
+import itertools
+import marshal
+import multiprocessing
 import sys
+from collections import deque, namedtuple
 from math import floor
 from xml.sax.saxutils import quoteattr
-from . import trees, treeanalysis
+from . import trees, treeanalysis, treecache, misc
 
 
 def parse_split_specification(split_spec, size):
@@ -82,60 +88,77 @@ def export_tabs(length):
 def export_format(subtree, **params):
     """Return an export formatted node line for a given subtree.
     """
-    if subtree.data['edge'] == None:
-        subtree.data['edge'] = '--'
-    label = trees.get_label(subtree, **params)
+    return formatters(**params).export_line(subtree)
+
+
+def export_line_formatter(**params):
+    """Return a function which computes the export formatted node line of
+    a subtree, see export_format().
+    """
+    get_label = trees.label_formatter(**params)
     if not 'export_four' in params:
-        return u"%s%s%s\t%s%s%s\t%d\n" \
-            % (subtree.data['word'],
-               export_tabs(len(subtree.data['word'])),
-               label,
-               subtree.data['morph'],
-               export_tabs(len(subtree.data['morph']) + 8),
-               subtree.data['edge'],
-               subtree.parent.data['num'])
+        def format_line(subtree):
+            data = subtree.data
+            if data['edge'] == None:
+                data['edge'] = '--'
+            return u"%s%s%s\t%s%s%s\t%d\n" \
+                % (data['word'],
+                   export_tabs(len(data['word'])),
+                   get_label(subtree),
+                   data['morph'],
+                   export_tabs(len(data['morph']) + 8),
+                   data['edge'],
+                   subtree.parent.data['num'])
     else:
-        return u"%s%s%s%s%s\t%s%s%s\t%d\n" \
-            % (subtree.data['word'],
-               export_tabs(len(subtree.data['word'])),
-               subtree.data['lemma'],
-               export_tabs(len(subtree.data['lemma'])),
-               label,
-               subtree.data['morph'],
-               export_tabs(len(subtree.data['morph']) + 8),
-               subtree.data['edge'],
-               subtree.parent.data['num'])
+        def format_line(subtree):
+            data = subtree.data
+            if data['edge'] == None:
+                data['edge'] = '--'
+            return u"%s%s%s%s%s\t%s%s%s\t%d\n" \
+                % (data['word'],
+                   export_tabs(len(data['word'])),
+                   data['lemma'],
+                   export_tabs(len(data['lemma'])),
+                   get_label(subtree),
+                   data['morph'],
+                   export_tabs(len(data['morph']) + 8),
+                   data['edge'],
+                   subtree.parent.data['num'])
+    return format_line
 
 
 def compute_export_numbering(tree):
-    """We compute the 'level' of each node, i.e., its minimal path length to a
+    """We compute the 'level' of each node, i.e., its maximal path length to a
     terminal. We then distribute numbers >= 500 from left to right in each
-    level, starting with the lowest one.
+    level, starting with the lowest one. Levels and leftmost terminals
+    are computed bottom-up in a single pass, the numbers are then assigned
+    in one sweep over the non-terminals sorted by level and leftmost
+    terminal. Return the non-terminals ordered by their numbers.
     """
+    nodes = []
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        nodes.append(node)
+        stack.extend(node.children)
     levels = {}
-    for subtree in trees.preorder(tree):
-        if trees.has_children(subtree):
-            level = 0
-            for terminal in trees.terminals(subtree):
-                path_length = 0
-                path_element = terminal
-                while not path_element == subtree:
-                    path_element = path_element.parent
-                    path_length += 1
-                level = max(level, path_length)
-            if not level in levels:
-                levels[level] = []
-            levels[level].append(subtree)
-    for level in levels:
-        levels[level] = sorted(levels[level], \
-                               key=lambda x: trees.terminals(x)[0].data['num'])
-    num = 500
-    for level_num in sorted(levels.keys()):
-        level = levels[level_num]
-        for subtree in level:
-            subtree.data['num'] = num
-            num += 1
+    firsts = {}
+    non_terms = []
+    # children come after their parents in nodes
+    for node in reversed(nodes):
+        if node.children:
+            levels[node] = 1 + max([levels[child] for child in node.children])
+            firsts[node] = min([firsts[child] for child in node.children])
+            non_terms.append(node)
+        else:
+            levels[node] = 0
+            # a root without children has no number
+            firsts[node] = node.data.get('num')
+    non_terms.sort(key=lambda node: (levels[node], firsts[node]))
+    for num, node in enumerate(non_terms, 500):
+        node.data['num'] = num
     tree.data['num'] = 0
+    return non_terms
 
 
 def export(tree, stream, **params):
@@ -143,24 +166,21 @@ def export(tree, stream, **params):
     """
     # check parameters
     tree_id = tree.data['sid']
-    compute_export_numbering(tree)
-    stream.write(u"#BOS %d\n" % tree_id)
-    terms = {}
-    non_terms = {}
-    for subtree in trees.preorder(tree):
-        if subtree == tree:
+    non_terms = compute_export_numbering(tree)
+    format_line = formatters(**params).export_line
+    lines = [u"#BOS %d\n" % tree_id]
+    terms = trees.terminals(tree) if trees.has_children(tree) else []
+    for terminal in terms:
+        terminal.data['parent_num'] = u"%d" % terminal.parent.data['num']
+        lines.append(format_line(terminal))
+    for subtree in non_terms:
+        if subtree is tree:
             continue
         subtree.data['parent_num'] = u"%d" % subtree.parent.data['num']
-        if trees.has_children(subtree):
-            subtree.data['word'] = u"#%d" % subtree.data['num']
-            non_terms[subtree.data['num']] = export_format(subtree, **params)
-        else:
-            terms[subtree.data['num']] = export_format(subtree, **params)
-    for num in sorted(terms.keys()):
-        stream.write(terms[num])
-    for num in sorted(non_terms.keys()):
-        stream.write(non_terms[num])
-    stream.write(u"#EOS %d\n" % tree_id)
+        subtree.data['word'] = u"#%d" % subtree.data['num']
+        lines.append(format_line(subtree))
+    lines.append(u"#EOS %d\n" % tree_id)
+    stream.write(u"".join(lines))
 
 
 def brackets_begin(stream, **params):
@@ -175,22 +195,44 @@ def brackets_end(stream, **params):
     pass
 
 
+def format_brackets_subtree(tree, **params):
+    """Return a single bracketed subtree as string.
+    """
+    return formatters(**params).brackets(tree)
+
+
+def brackets_formatter(**params):
+    """Return a function which computes the bracketed string of a subtree,
+    see format_brackets_subtree().
+    """
+    emptyroot = 'brackets_emptyroot' in params
+    get_label = trees.label_formatter(**params)
+    def format_subtree(tree):
+        result = []
+        # None marks the end of a phrase
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                result.append(u")")
+            elif node.children:
+                result.append(u"(")
+                if not (emptyroot and node is tree):
+                    result.append(get_label(node))
+                stack.append(None)
+                stack.extend(reversed(trees.children(node)))
+            else:
+                node = trees.replace_chars(node, trees.BRACKETS)
+                result.append(u"(%s %s)" % (get_label(node),
+                                            node.data['word']))
+        return u"".join(result)
+    return format_subtree
+
+
 def write_brackets_subtree(tree, stream, **params):
     """Write a single bracketed subtree.
     """
-    stream.write(u"(")
-    if trees.has_children(tree):
-        if not 'brackets_emptyroot' in params:
-            stream.write(trees.get_label(tree, **params))
-        else:
-            del params['brackets_emptyroot']
-        for child in trees.children(tree):
-            write_brackets_subtree(child, stream, **params)
-    else:
-        tree = trees.replace_chars(tree, trees.BRACKETS)
-        stream.write(trees.get_label(tree, **params))
-        stream.write(u" %s" % tree.data['word'])
-    stream.write(u")")
+    stream.write(format_brackets_subtree(tree, **params))
 
 
 def brackets(tree, stream, **params):
@@ -198,8 +240,7 @@ def brackets(tree, stream, **params):
     """
     if treeanalysis.gap_degree(tree) > 0:
         raise ValueError("cannot write a discontinuous trees with brackets.")
-    write_brackets_subtree(tree, stream, **params)
-    stream.write(u"\n")
+    stream.write(format_brackets_subtree(tree, **params) + u"\n")
 
 
 def discobrackets_begin(stream, **params):
@@ -220,11 +261,11 @@ def discobrackets(tree, stream, **params):
     separated from the tree by a tab (terminal space-separated).
     """
     terminals = trees.terminals(tree)
-    sentence = ' '.join([terminal.data['word'] for terminal in terminals])
+    sentence = u' '.join([terminal.data['word'] for terminal in terminals])
     for terminal in terminals:
         terminal.data['word'] = unicode(terminal.data['num'])
-    write_brackets_subtree(tree, stream, **params)
-    stream.write("\t" + sentence + "\n")
+    stream.write(u"%s\t%s\n" % (format_brackets_subtree(tree, **params),
+                                 sentence))
 
 
 def terminals_begin(stream, **params):
@@ -242,33 +283,64 @@ def terminals_end(stream, **params):
 def terminals(tree, stream, **params):
     """All terminals of the tree on one line separated by whitespace.
     """
-    for terminal in trees.terminals(tree):
-        if 'terminals_one' in params:
-            result = terminal.data['word']
-            if 'terminals_pos' in params:
-                result += "\t%s" % terminal.data['label']
-            print(result, file=stream)
+    stream.write(formatters(**params).terminals(tree))
+
+
+def terminals_formatter(**params):
+    """Return a function which computes the output of terminals() for
+    a tree.
+    """
+    pos = 'terminals_pos' in params
+    if 'terminals_one' in params:
+        template = u"%s\t%s\n" if pos else u"%s\n"
+    else:
+        template = u"%s/%s " if pos else u"%s "
+    def format_terminals(tree):
+        if pos:
+            result = [template % (terminal.data['word'],
+                                  terminal.data['label'])
+                      for terminal in trees.terminals(tree)]
         else:
-            result = terminal.data['word']
-            if 'terminals_pos' in params:
-                result += "/%s" % terminal.data['label']
-            print(unicode(result), end=u" ", file=stream)
-    print(u"", file=stream)
+            result = [template % terminal.data['word']
+                      for terminal in trees.terminals(tree)]
+        result.append(u"\n")
+        return u"".join(result)
+    return format_terminals
+
+
+Formatters = namedtuple('Formatters', ['label', 'export_line', 'brackets',
+                                       'terminals'])
+
+
+@misc.memoize(maxsize=64)
+def _formatters(options):
+    """Return the formatters for a sorted tuple of output options.
+    """
+    params = dict(options)
+    return Formatters(trees.label_formatter(**params),
+                      export_line_formatter(**params),
+                      brackets_formatter(**params),
+                      terminals_formatter(**params))
+
+
+def formatters(**params):
+    """Return the formatters (functions computing labels, export lines,
+    bracketed trees and terminal lines) specialized for the given output
+    options. They are built once for every combination of options.
+    """
+    return _formatters(tuple(sorted(params.items())))
 
 
 def tigerxml_begin(stream, **params):
     """The start of a tigerxml document. To be completed.
     """
-    stream.write(u"<?xml version='1.0'?>\n")
-    stream.write(u"<corpus>\n")
-    stream.write(u"<body>\n")
+    stream.write(u"<?xml version='1.0'?>\n<corpus>\n<body>\n")
 
 
 def tigerxml_end(stream, **params):
     """The end of a tigerxml document, to be completed.
     """
-    stream.write(u"</body>\n")
-    stream.write(u"</corpus>")
+    stream.write(u"</body>\n</corpus>")
 
 
 def tigerxml(tree, stream, **params):
@@ -276,33 +348,117 @@ def tigerxml(tree, stream, **params):
     be more fancy.
     """
     compute_export_numbering(tree)
-    stream.write(u"<s id=\"%d\">\n" % tree.data['sid'])
-    stream.write(u"<graph root=\"%s\">\n" % tree.data['num'])
-    stream.write(u"  <terminals>\n")
+    lines = [u"<s id=\"%d\">\n" % tree.data['sid'],
+             u"<graph root=\"%s\">\n" % tree.data['num'],
+             u"  <terminals>\n"]
     for terminal in trees.terminals(tree):
-        stream.write(u"    <t id=\"%d\" " % terminal.data['num'])
-        for field in ['word', 'lemma', 'label', 'morph']:
-            terminal.data[field] = quoteattr(terminal.data[field])
-        stream.write(u"%s=%s " % ('word', terminal.data['word']))
-        stream.write(u"%s=%s " % ('lemma', terminal.data['lemma']))
-        stream.write(u"%s=%s " % ('pos', terminal.data['label']))
-        stream.write(u"%s=%s " % ('morph', terminal.data['morph']))
-        stream.write(u"/>\n")
-    stream.write(u"  </terminals>\n")
-    stream.write(u"  <nonterminals>\n")
+        lines.append(u"    <t id=\"%d\" word=%s lemma=%s pos=%s morph=%s />\n"
+                     % (terminal.data['num'],
+                        quoteattr(terminal.data['word']),
+                        quoteattr(terminal.data['lemma']),
+                        quoteattr(terminal.data['label']),
+                        quoteattr(terminal.data['morph'])))
+    lines.append(u"  </terminals>\n")
+    lines.append(u"  <nonterminals>\n")
     for subtree in trees.postorder(tree):
         if trees.has_children(subtree):
-            stream.write(u"    <nt id=\"%d\" cat=%s>\n"
+            lines.append(u"    <nt id=\"%d\" cat=%s>\n"
                          % (subtree.data['num'],
                             quoteattr(subtree.data['label'])))
             for child in trees.children(subtree):
-                stream.write(u"      <edge label=%s idref=\"%d\" />\n"
+                lines.append(u"      <edge label=%s idref=\"%d\" />\n"
                              % (quoteattr(child.data['edge']),
                                 child.data['num']))
-            stream.write(u"    </nt>\n")
-    stream.write(u"  </nonterminals>\n")
-    stream.write(u"</graph>\n")
-    stream.write(u"</s>\n")
+            lines.append(u"    </nt>\n")
+    lines.append(u"  </nonterminals>\n</graph>\n</s>\n")
+    stream.write(u"".join(lines))
+
+
+# number of trees rendered per job in write_trees()
+WRITE_BATCH_SIZE = 250
+
+
+def render(tree, out_format, **params):
+    """Return the output of the writer for the given format for a single
+    tree as string.
+    """
+    stream = io.StringIO()
+    getattr(sys.modules[__name__], out_format)(tree, stream, **params)
+    return stream.getvalue()
+
+
+def _encode_batch(tree_batch, out_format, encoding, params):
+    """Render a list of trees and return the encoded output.
+    """
+    encode = codecs.getincrementalencoder(encoding)().encode
+    # the byte order mark (if any) is written by the output stream
+    encode(u"")
+    return encode(u"".join([render(tree, out_format, **params)
+                            for tree in tree_batch]))
+
+
+def _render_batch(job):
+    """Render a batch of trees in a worker process and return the encoded
+    output, see write_trees(). The trees are passed serialized with
+    marshal (see treecache.dump_tree()), which, unlike pickling, works
+    at any tree depth.
+    """
+    dumped, out_format, encoding, params = job
+    tree_batch = [treecache.load_tree(nodes)
+                  for nodes in marshal.loads(dumped)]
+    return _encode_batch(tree_batch, out_format, encoding, params)
+
+
+def write_trees(tree_iter, out_format, stream, jobs=1, **params):
+    """Write trees from an iterable in the given output format, preceded
+    and followed by the begin and end output of the format. Return the
+    number of trees. With jobs > 1, batches of trees are rendered and
+    encoded by that many worker processes and written in input order by
+    the calling process, which keeps at most 2 * jobs batches pending; the
+    stream must then be a misc.BufferedOutput. Batches with node data
+    which cannot be marshalled are rendered by the calling process.
+    """
+    module = sys.modules[__name__]
+    getattr(module, out_format + '_begin')(stream, **params)
+    count = 0
+    # processes of a pool cannot start their own workers
+    if jobs <= 1 or multiprocessing.current_process().daemon:
+        writer = getattr(module, out_format)
+        for tree in tree_iter:
+            writer(tree, stream, **params)
+            count += 1
+    else:
+        tree_iter = iter(tree_iter)
+        batches = iter(lambda: list(itertools.islice(tree_iter,
+                                                     WRITE_BATCH_SIZE)), [])
+        pool = multiprocessing.Pool(jobs)
+        try:
+            pending = deque()
+            for tree_batch in batches:
+                count += len(tree_batch)
+                try:
+                    dumped = marshal.dumps([treecache.dump_tree(tree)
+                                            for tree in tree_batch])
+                except ValueError:
+                    while pending:
+                        stream.write_encoded(pending.popleft().get())
+                    stream.write_encoded(_encode_batch(tree_batch,
+                                                       out_format,
+                                                       stream.encoding,
+                                                       params))
+                    continue
+                job = (dumped, out_format, stream.encoding, params)
+                pending.append(pool.apply_async(_render_batch, (job,)))
+                if len(pending) >= 2 * jobs:
+                    stream.write_encoded(pending.popleft().get())
+            while pending:
+                stream.write_encoded(pending.popleft().get())
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+    getattr(module, out_format + '_end')(stream, **params)
+    return count
 
 
 OUTPUT_FORMATS = [export, brackets, discobrackets, tigerxml, terminals]
@@ -7,9 +7,10 @@ Author: Wolfgang Maier <maierw@hhu.de>
 """
 from __future__ import print_function
 import itertools
+import re
 import sys
-from copy import deepcopy
-from collections import namedtuple
+from collections import deque, namedtuple
+from . import misc
 
 
 # separators in labels
@@ -45,25 +46,304 @@ DEFAULT_MORPH = u"--"
 DEFAULT_EDGE = u"--"
 DEFAULT_ROOT = u"VROOT"
 
+
+class SymbolTable(object):
+    """Table of interned symbols (labels, edges, morphological tags,
+    lemmas). Identical strings are represented by a single object, and each
+    symbol has an integer id. The readers in treeinput create a new table
+    per call which is not accessible from the outside; to obtain ids which
+    are stable across the trees of one or several files (e.g. as keys in
+    grammar extraction or analysis tasks), pass a table with the symbols
+    parameter and map the symbols of the trees with id().
+    """
+    def __init__(self):
+        self.symbols = []
+        self.ids = {}
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def __getitem__(self, symbol_id):
+        return self.symbols[symbol_id]
+
+    def __contains__(self, symbol):
+        return symbol in self.ids
+
+    def id(self, symbol):
+        """Return the id of the given symbol, add it if it is new.
+        """
+        try:
+            return self.ids[symbol]
+        except KeyError:
+            self.ids[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+            return self.ids[symbol]
+
+    def intern(self, symbol):
+        """Return the interned instance of the given symbol, add it if it is
+        new.
+        """
+        try:
+            return self.symbols[self.ids[symbol]]
+        except KeyError:
+            return self.symbols[self.id(symbol)]
+
+
+def symbol_table():
+    """Return a new symbol table which holds the default symbols.
+    """
+    table = SymbolTable()
+    for symbol in [DEFAULT_LEMMA, DEFAULT_LABEL, DEFAULT_MORPH, DEFAULT_EDGE,
+                   DEFAULT_ROOT]:
+        table.intern(symbol)
+    return table
+
+
+def _identity(symbol):
+    """Return the given symbol, used instead of interning without a table.
+    """
+    return symbol
+
+
+def interner(symbols):
+    """Return the intern function of the given symbol table, or a function
+    which returns its argument if the table is None.
+    """
+    if symbols is None:
+        return _identity
+    return symbols.intern
+
+
+# fields which are held in slots of the node data, all other keys go
+# into an overflow dict
+NODE_FIELDS = ('word', 'lemma', 'label', 'morph', 'edge', 'num', 'parent_num')
+_NODE_FIELDS_SET = frozenset(NODE_FIELDS)
+
+
+class NodeData(object):
+    """Compact replacement for the node data dict. The fields in NODE_FIELDS
+    are stored in slots, any other key (such as 'head', 'split' or
+    'block_number') goes into an overflow dict which is only created when
+    needed. The usual dict operations are supported. A field which has never
+    been assigned counts as absent, i.e., 'num' in data is False until a
+    number has been given to the node. New instances are constructed by
+    shallow-copying a given dict or node data. Node data obtained with
+    fork() shares the overflow dict with its origin until one of both
+    writes to it (copy-on-write). Node data knows the node it belongs to,
+    such that assigning data['num'] on a terminal marks the cached
+    orderings of the tree as stale (see set_num()).
+    """
+    __slots__ = NODE_FIELDS + ('extra', '_shared', '_node')
+
+    def __init__(self, data=None):
+        self.word = None
+        self.lemma = None
+        self.label = None
+        self.morph = None
+        self.edge = None
+        self.parent_num = None
+        self.extra = None
+        self._shared = False
+        self._node = None
+        if data is not None:
+            self.update(data)
+
+    def __getitem__(self, key):
+        if key in _NODE_FIELDS_SET:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        if self.extra is None:
+            raise KeyError(key)
+        return self.extra[key]
+
+    def __setitem__(self, key, value):
+        if key in _NODE_FIELDS_SET:
+            setattr(self, key, value)
+            if key == 'num':
+                self._num_changed()
+        else:
+            self._own_extra()
+            self.extra[key] = value
+
+    def __delitem__(self, key):
+        if key in _NODE_FIELDS_SET:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+            if key == 'num':
+                self._num_changed()
+        else:
+            if self.extra is None or not key in self.extra:
+                raise KeyError(key)
+            self._own_extra()
+            del self.extra[key]
+
+    def __contains__(self, key):
+        if key in _NODE_FIELDS_SET:
+            return hasattr(self, key)
+        return self.extra is not None and key in self.extra
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        if isinstance(other, (NodeData, dict)):
+            return dict(self.items()) == dict(other.items())
+        return False
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "NodeData(%r)" % dict(self.items())
+
+    def __getstate__(self):
+        return dict(self.items())
+
+    def __setstate__(self, state):
+        self.__init__(state)
+
+    def get(self, key, default=None):
+        """Return the value for key if present, default otherwise.
+        """
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        """Return a list of all present keys.
+        """
+        result = [key for key in NODE_FIELDS if hasattr(self, key)]
+        if self.extra is not None:
+            result.extend(self.extra.keys())
+        return result
+
+    def values(self):
+        """Return a list of all values.
+        """
+        return [self[key] for key in self.keys()]
+
+    def items(self):
+        """Return a list of all key/value pairs.
+        """
+        return [(key, self[key]) for key in self.keys()]
+
+    def update(self, other):
+        """Update from a dict or another node data (shallow).
+        """
+        if isinstance(other, NodeData):
+            for key in NODE_FIELDS:
+                if hasattr(other, key):
+                    setattr(self, key, getattr(other, key))
+            if other.extra is not None:
+                self._own_extra()
+                self.extra.update(other.extra)
+            if hasattr(other, 'num'):
+                self._num_changed()
+        else:
+            for key, value in other.items():
+                if key in _NODE_FIELDS_SET:
+                    setattr(self, key, value)
+                else:
+                    self._own_extra()
+                    self.extra[key] = value
+            if 'num' in other:
+                self._num_changed()
+
+    def copy(self):
+        """Return a shallow copy.
+        """
+        return NodeData(self)
+
+    def fork(self):
+        """Return a shallow copy which shares the overflow dict with this
+        node data until one of both modifies it.
+        """
+        result = NodeData()
+        for key in NODE_FIELDS:
+            if hasattr(self, key):
+                setattr(result, key, getattr(self, key))
+        if self.extra is not None:
+            self._shared = True
+            result.extra = self.extra
+            result._shared = True
+        return result
+
+    def _own_extra(self):
+        """Make sure that there is an overflow dict which is not shared
+        with other node data.
+        """
+        if self.extra is None:
+            self.extra = {}
+            self._shared = False
+        elif self._shared:
+            self.extra = dict(self.extra)
+            self._shared = False
+
+    def _num_changed(self):
+        """Mark the caches of the node and its ancestors as stale if the
+        node is a terminal in a tree (numbers of non-terminals do not
+        determine any order).
+        """
+        node = self._node
+        if node is not None and not node.children:
+            _invalidate_path(node)
+
+
 class Tree(object):
     """A tree is represented by a unique ID per instance, a parent, a
-    children list, and a data dict. New instances are constructed by
-    copying given data dict. If there are no children, there must be a
-    num key in the data dict which denotes the position
-    index. Repeated or unspecified indices are an error. Note that
-    comparison between Trees is done solely on the basis of the unique
-    ID.
+    children list, and a node data (see NodeData, which behaves like a
+    dict). New instances are constructed by shallow-copying the given data
+    dict or node data (values are expected to be immutable); without data,
+    all fields are pre-initialized with None as in make_node_data(). If
+    there are no children, there must be a num key in the data which denotes
+    the position index. Repeated or unspecified indices are an error. Note
+    that comparison between Trees is done solely on the basis of the unique
+    ID. The ordered children and terminals of each node are cached (see
+    children() and terminals()); the structure of a tree should therefore
+    only be modified with add_child(), remove_child() and move_subtree()
+    (or invalidate() must be called afterwards). Terminals are renumbered
+    with set_num() or by assigning data['num']. A dict, or node data
+    belonging to another node, assigned to the data attribute is copied.
     """
+    __slots__ = ('id', 'children', 'parent', 'data', '_cache', '__weakref__')
     # unique id generator
     newid = itertools.count()
 
-    def __init__(self, data):
-        """Construct a new tree and copy given data dict.
+    def __init__(self, data=None):
+        """Construct a new tree and copy given data.
         """
-        self.id = next(Tree.newid)
-        self.children = []
-        self.parent = None
-        self.data = deepcopy(data)
+        # the node is new, the slots can be set directly (see __setattr__)
+        set_slot = object.__setattr__
+        set_slot(self, 'id', next(Tree.newid))
+        set_slot(self, 'children', [])
+        set_slot(self, 'parent', None)
+        set_slot(self, '_cache', None)
+        data = NodeData(data)
+        data._node = self
+        set_slot(self, 'data', data)
+
+    def __setattr__(self, name, value):
+        # node data must know its node, see NodeData
+        if name == 'data':
+            if not isinstance(value, NodeData) \
+                    or value._node is not None and value._node is not self:
+                value = NodeData(value)
+            value._node = self
+            object.__setattr__(self, name, value)
+            # the number of the node may have changed
+            value._num_changed()
+        else:
+            object.__setattr__(self, name, value)
 
     def __eq__(self, other):
         if isinstance(other, self.__class__):
@@ -78,6 +358,31 @@ class Tree(object):
         return hash(self.id)
 
 
+def clone(tree):
+    """Return a copy of the given tree which can be transformed
+    independently of the original. Nodes are newly created (since they
+    are linked to their parents, they cannot be shared), the node data
+    is forked (see NodeData.fork()), i.e., only the slot fields are copied
+    while other keys are copied on write. The children of the copy are
+    already ordered.
+    """
+    result = Tree.__new__(Tree)
+    result.parent = None
+    stack = [(tree, result)]
+    while stack:
+        node, copy = stack.pop()
+        copy.id = next(Tree.newid)
+        copy.children = []
+        copy._cache = None
+        copy.data = node.data.fork()
+        for child in children(node) if node.children else []:
+            child_copy = Tree.__new__(Tree)
+            child_copy.parent = copy
+            copy.children.append(child_copy)
+            stack.append((child, child_copy))
+    return result
+
+
 def make_node_data():
     """Make an empty node data and pre-initialize with fields
     """
@@ -100,28 +405,163 @@ def make_node_data_fill():
 
 def preorder(tree):
     """Generator which performs a preorder tree traversal and yields
-    the subtrees encountered on its way.
+    the subtrees encountered on its way. The children of a node are
+    determined when the traversal proceeds below it. Works with an explicit
+    stack, i.e., at any tree depth.
     """
-    yield tree
-    for child in children(tree):
-        for child_tree in preorder(child):
-            yield child_tree
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        yield node
+        if node.children:
+            stack.extend(reversed(children(node)))
+
+
+def preorder_with_depth(tree):
+    """Like preorder(), but yields pairs of subtree and depth (distance
+    to the given tree).
+    """
+    stack = [(tree, 0)]
+    while stack:
+        node, depth = stack.pop()
+        yield node, depth
+        if node.children:
+            stack.extend([(child, depth + 1)
+                          for child in reversed(children(node))])
 
 
 def postorder(tree):
     """Generator which performs a postorder tree traversal and yields
-    the subtrees encountered on its way.
+    the subtrees encountered on its way. The children of a node are
+    determined when the traversal reaches it. Works with an explicit
+    stack, i.e., at any tree depth.
+    """
+    for node, _ in postorder_with_depth(tree):
+        yield node
+
+
+def postorder_with_depth(tree):
+    """Like postorder(), but yields pairs of subtree and depth (distance
+    to the given tree).
+    """
+    # entries are (node, depth, expanded)
+    stack = [(tree, 0, False)]
+    while stack:
+        node, depth, expanded = stack.pop()
+        if expanded or not node.children:
+            yield node, depth
+        else:
+            stack.append((node, depth, True))
+            stack.extend([(child, depth + 1, False)
+                          for child in reversed(children(node))])
+
+
+def levelorder(tree):
+    """Generator which performs a level-order (breadth-first) tree
+    traversal and yields the subtrees encountered on its way, from left
+    to right on each level.
+    """
+    for node, _ in levelorder_with_depth(tree):
+        yield node
+
+
+def levelorder_with_depth(tree):
+    """Like levelorder(), but yields pairs of subtree and depth (distance
+    to the given tree).
+    """
+    queue = deque([(tree, 0)])
+    while queue:
+        node, depth = queue.popleft()
+        yield node, depth
+        if node.children:
+            queue.extend([(child, depth + 1) for child in children(node)])
+
+
+def invalidate(tree):
+    """Mark the cached child orderings and terminal lists of all nodes of
+    the given tree as stale. This must be called explicitly when modifying
+    children lists or terminal numbers by other means than add_child(),
+    remove_child(), move_subtree(), set_num() and assignment of
+    data['num'].
+    """
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        node._cache = None
+        stack.extend(node.children)
+    _invalidate_path(tree.parent)
+
+
+def _invalidate_path(tree):
+    """Mark the caches of the given node and all of its ancestors as
+    stale after a change of its children or terminals. A node's cache is
+    only computed after the ones of its children, we can therefore stop
+    at the first node whose cache is already stale.
+    """
+    while tree is not None and tree._cache is not None:
+        tree._cache = None
+        tree = tree.parent
+
+
+def set_num(terminal, num):
+    """Give a new number to a terminal. Since the numbers determine the
+    order of children and terminals, the caches of the terminal and its
+    ancestors are marked as stale (like when assigning data['num']).
     """
-    for child in children(tree):
-        for child_tree in postorder(child):
-            yield child_tree
-    yield tree
+    terminal.data.num = num
+    _invalidate_path(terminal)
+
+
+def _terminal_num(terminal):
+    """Sort key for terminals.
+    """
+    return terminal.data.num
+
+
+def _compute_cache(tree):
+    """Compute the cache of the given node, i.e., a tuple of the ordered
+    children, the ordered terminals and the span (see span()). The caches
+    of all children must be up to date.
+    """
+    if len(tree.children) == 0:
+        if not 'num' in tree.data:
+            raise ValueError("no number in node data of terminal %s/%s" \
+                             % (tree.data['word'], tree.data['label']))
+        return ((), (tree,), 1 << tree.data.num)
+    child_caches = [(child._cache[1], child) for child in tree.children]
+    child_caches.sort(key=lambda x: x[0][0].data.num)
+    result = []
+    node_span = 0
+    for child_terms, child in child_caches:
+        result.extend(child_terms)
+        node_span |= child._cache[2]
+    result.sort(key=_terminal_num)
+    return (tuple([child for _, child in child_caches]), tuple(result),
+            node_span)
+
+
+def _ordered(tree):
+    """Return the cache of the given node (see _compute_cache()) and
+    recompute it bottom-up where it is stale.
+    """
+    cache = tree._cache
+    if cache is not None:
+        return cache
+    stack = [(tree, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if expanded:
+            node._cache = _compute_cache(node)
+        elif node._cache is None:
+            stack.append((node, True))
+            stack.extend([(child, False) for child in node.children])
+    return tree._cache
 
 
 def children(tree):
     """Return the ordered children of the root of this tree.
     """
-    return sorted(tree.children, key=lambda x: terminals(x)[0].data['num'])
+    return list(_ordered(tree)[0])
 
 
 def has_children(tree):
@@ -133,42 +573,112 @@ def has_children(tree):
 def unordered_terminals(tree):
     """Return all terminal children of this subtree.
     """
-    if len(tree.children) == 0:
-        return [tree]
-    else:
-        result = []
-        for child in tree.children:
-            result.extend(unordered_terminals(child))
-        return result
+    result = []
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if len(node.children) == 0:
+            result.append(node)
+        else:
+            stack.extend(reversed(node.children))
+    return result
 
 
 def terminals(tree):
     """Return all terminal children of this subtree.
     """
-    if len(tree.children) == 0:
-        if not 'num' in tree.data:
-            raise ValueError("no number in node data of terminal %s/%s" \
-                             % (tree.data['word'], tree.data['label']))
-        return [tree]
-    else:
-        result = []
-        for child in tree.children:
-            result.extend(terminals(child))
-        return sorted(result, key=lambda x: x.data['num'])
+    return list(_ordered(tree)[1])
+
+
+def terminal_bounds(tree):
+    """Return the numbers of the leftmost and the rightmost terminal
+    of this subtree.
+    """
+    terms = _ordered(tree)[1]
+    return terms[0].data.num, terms[-1].data.num
+
+
+def span(tree):
+    """Return the terminal positions covered by the root of this tree as
+    integer bitmask, bit i is set if the terminal with number i is covered.
+    """
+    return _ordered(tree)[2]
+
+
+def is_continuous(tree):
+    """Return true if the terminals covered by the root of this tree form
+    a single continuous block.
+    """
+    covered = span(tree)
+    # shift away trailing zeros, then there must be no zero left
+    covered //= covered & -covered
+    return covered & (covered + 1) == 0
+
+
+def blocks(tree):
+    """Return the continuous blocks of terminals covered by the root of
+    this tree as list of pairs of the numbers of the leftmost and
+    rightmost terminal in each block.
+    """
+    result = []
+    covered = span(tree)
+    while covered:
+        lowest = covered & -covered
+        # adding the lowest bit carries over the whole lowest block
+        carried = covered + lowest
+        start = lowest.bit_length() - 1
+        end = (carried & -carried).bit_length() - 2
+        result.append((start, end))
+        covered &= carried
+    return result
+
+
+def gap_degree(tree):
+    """Return the gap degree of the root of this tree, i.e., the number of
+    its terminal blocks minus one.
+    """
+    covered = span(tree)
+    # bits which start a block
+    return bin(covered & ~(covered << 1)).count('1') - 1
 
 
 def terminal_blocks(tree):
     """Return an array of arrays of terminals representing the
     continuous blocks covered by the root of the tree given as
     argument."""
-    blocks = [[]]
-    terms = terminals(tree)
-    for i, terminal in enumerate(terms[:-1]):
-        blocks[-1].append(terminal)
-        if terms[i].data['num'] + 1 < terms[i + 1].data['num']:
-            blocks.append([])
-    blocks[-1].append(terms[-1])
-    return blocks
+    terms = _ordered(tree)[1]
+    result = []
+    position = 0
+    for start, end in blocks(tree):
+        result.append(list(terms[position:position + end - start + 1]))
+        position += end - start + 1
+    return result
+
+
+def add_child(tree, child):
+    """Attach child (which must not have a parent) below tree.
+    """
+    if child.parent is not None:
+        raise ValueError("node is already attached")
+    tree.children.append(child)
+    child.parent = tree
+    _invalidate_path(tree)
+
+
+def remove_child(tree, child):
+    """Detach child from tree.
+    """
+    tree.children.remove(child)
+    child.parent = None
+    _invalidate_path(tree)
+
+
+def move_subtree(subtree, target):
+    """Detach subtree from its parent (if any) and attach it below target.
+    """
+    if subtree.parent is not None:
+        remove_child(subtree.parent, subtree)
+    add_child(target, subtree)
 
 
 def delete_terminal(tree, leaf):
@@ -184,16 +694,48 @@ def delete_terminal(tree, leaf):
     num = leaf.data['num']
     parent = leaf.parent
     while parent is not None and len(leaf.children) == 0:
-        parent.children.remove(leaf)
+        remove_child(parent, leaf)
         leaf = parent
         parent = leaf.parent
     # shift numbering
     for terminal in terms:
         if terminal.data['num'] > num:
-            terminal.data['num'] -= 1
+            set_num(terminal, terminal.data['num'] - 1)
     return leaf
 
 
+def delete_terminals(tree, leaves):
+    """Delete several leaf nodes at once, together with all of their
+    ancestors which are left without children, and renumber the remaining
+    terminals in a single pass. Any node of the tree can be given. Return
+    the root of the tree.
+    """
+    root = tree
+    while not root.parent == None:
+        root = root.parent
+    nums = []
+    for leaf in leaves:
+        nums.append(leaf.data['num'])
+        parent = leaf.parent
+        while parent is not None and len(leaf.children) == 0:
+            remove_child(parent, leaf)
+            leaf = parent
+            parent = leaf.parent
+    if len(root.children) == 0:
+        # all terminals have been deleted
+        return root
+    # shift numbering by the number of deleted terminals to the left
+    nums.sort()
+    shift = 0
+    for terminal in terminals(root):
+        num = terminal.data['num']
+        while shift < len(nums) and nums[shift] < num:
+            shift += 1
+        if shift > 0:
+            set_num(terminal, num - shift)
+    return root
+
+
 def right_sibling(tree):
     """Return the right sibling of this tree if it exists and None otherwise.
     """
@@ -239,6 +781,69 @@ def lca(tree_a, tree_b):
     return None
 
 
+class LcaIndex(object):
+    """Index for constant-time least common ancestor queries on a tree,
+    built once in linear time from an Euler tour of the tree and a sparse
+    table of range minima over the depths of the nodes on the tour. The
+    index describes the tree as it was when the index was built.
+    """
+    def __init__(self, tree):
+        self.root = tree
+        # Euler tour: nodes and their depths
+        self.euler = []
+        depths = []
+        # position of the first occurrence of each node in the tour
+        self.first = {}
+        stack = [(tree, 0, iter(tree.children))]
+        self.first[tree] = 0
+        self.euler.append(tree)
+        depths.append(0)
+        while stack:
+            node, depth, child_iter = stack[-1]
+            child = next(child_iter, None)
+            if child is None:
+                stack.pop()
+                if stack:
+                    self.euler.append(stack[-1][0])
+                    depths.append(stack[-1][1])
+            else:
+                self.first[child] = len(self.euler)
+                self.euler.append(child)
+                depths.append(depth + 1)
+                stack.append((child, depth + 1, iter(child.children)))
+        # table[k][i] is the position of the minimal depth in the tour
+        # between i and i + 2 ** k - 1
+        self.depths = depths
+        self.table = [list(range(len(depths)))]
+        width = 1
+        while 2 * width <= len(depths):
+            last = self.table[-1]
+            row = []
+            for i in range(len(depths) - 2 * width + 1):
+                left, right = last[i], last[i + width]
+                row.append(left if depths[left] <= depths[right] else right)
+            self.table.append(row)
+            width *= 2
+
+    def lca(self, tree_a, tree_b):
+        """Return the least common ancestor of two nodes and None if one
+        of them is not part of the indexed tree.
+        """
+        try:
+            i = self.first[tree_a]
+            j = self.first[tree_b]
+        except KeyError:
+            return None
+        if i > j:
+            i, j = j, i
+        k = (j - i + 1).bit_length() - 1
+        left = self.table[k][i]
+        right = self.table[k][j - (1 << k) + 1]
+        if self.depths[left] <= self.depths[right]:
+            return self.euler[left]
+        return self.euler[right]
+
+
 def dominance(tree):
     """Return all ancestors of this tree including the tree itself.
     """
@@ -252,31 +857,55 @@ def dominance(tree):
 def get_label(tree, **params):
     """Compute subtree label decorations depending on given parameters.
     """
-    label = tree.data['label']
-    gf_separator = DEFAULT_GF_SEPARATOR
-    if 'gf_separator' in params:
-        gf_separator = unicode(params['gf_separator'])
-    gf_string = ""
-    if 'gf' in params and not tree.data['edge'].startswith("-") \
-       and (has_children(tree)
-            or 'gf_terminals' in params):
-        gf_string = "%s%s" % (gf_separator, tree.data['edge'])
-    head = ""
-    if 'mark_heads_marking' in params and tree.data['head']:
-        head = DEFAULT_HEAD_MARKER
-    split_marker = ""
-    if 'boyd_split_marking' in params and tree.data['split']:
-        split_marker = "*"
-    split_number = ""
-    if 'boyd_split_numbering' in params and tree.data['split']:
-        split_number = tree.data['block_number']
-    return u"%s%s%s%s%s" % (label, gf_string, head, split_marker, split_number)
-
-
-class Label(object):
-    """Dummy class for labels
-    """
-    pass
+    return label_formatter(**params)(tree)
+
+
+def label_formatter(**params):
+    """Return a function which computes the decorated label of a subtree
+    (see get_label()). The parameters are inspected only once, here.
+    """
+    gf_separator = unicode(params.get('gf_separator', DEFAULT_GF_SEPARATOR))
+    gf = 'gf' in params
+    gf_terminals = 'gf_terminals' in params
+    heads = 'mark_heads_marking' in params
+    split_marking = 'boyd_split_marking' in params
+    split_numbering = 'boyd_split_numbering' in params
+    if not (gf or heads or split_marking or split_numbering):
+        def format_plain(tree):
+            return u"%s" % tree.data['label']
+        return format_plain
+    def format_decorated(tree):
+        data = tree.data
+        gf_string = ""
+        if gf and not data['edge'].startswith("-") \
+           and (gf_terminals or tree.children):
+            gf_string = gf_separator + data['edge']
+        head = ""
+        if heads and data['head']:
+            head = DEFAULT_HEAD_MARKER
+        split_marker = ""
+        split_number = ""
+        if (split_marking or split_numbering) and data['split']:
+            if split_marking:
+                split_marker = "*"
+            if split_numbering:
+                split_number = data['block_number']
+        return u"%s%s%s%s%s" % (data['label'], gf_string, head, split_marker,
+                                split_number)
+    return format_decorated
+
+
+Label = namedtuple('Label', ['label', 'gf', 'gf_separator', 'coindex',
+                             'gapindex', 'headmarker', 'is_trace'])
+# maximal number of cached parsed/formatted labels
+LABEL_CACHE_SIZE = 4096
+# patterns for parse_label
+COINDEX_PATTERN = re.compile(r"^(.*)%s(\d+)\Z" \
+                             % re.escape(DEFAULT_COINDEX_SEPARATOR),
+                             re.DOTALL | re.UNICODE)
+GAPINDEX_PATTERN = re.compile(r"^(.*)%s(\d+)\Z" \
+                              % re.escape(DEFAULT_GAPPING_SEPARATOR),
+                              re.DOTALL | re.UNICODE)
 
 
 def parse_label(label, **params):
@@ -289,73 +918,76 @@ def parse_label(label, **params):
     LABEL: \S+, GF_SEP: [#\-], GF: [^\-\=#\s]+
     COINDEX_SEP: \-, GAPINDEX_SEP: \=, CO/GAPINDEX: \d+
 
-    Single parts are returned as namedtuple. Non-presented parts
-    are returned with default values from tree.py (or empty).
+    Single parts are returned as namedtuple (Label). Non-presented parts
+    are returned with default values from tree.py (or empty). Results are
+    cached (see LABEL_CACHE_SIZE).
     """
     gf_separator = DEFAULT_GF_SEPARATOR
-    if gf_separator in params:
+    if 'gf_separator' in params:
         gf_separator = params['gf_separator']
+    return _parse_label(label, gf_separator)
+
+
+@misc.memoize(LABEL_CACHE_SIZE)
+def _parse_label(label, gf_separator):
+    """Parse a label, see parse_label().
+    """
     # start from the back
     # head marker
     headmarker = ""
     if len(label) > 0 and label[-1] == DEFAULT_HEAD_MARKER:
         headmarker = label[-1]
         label = label[:-1]
-    # coindex or gapping sep (PTB)
+    # coindex or gapping index (PTB) after last separator
     coindex = ""
     gapindex = ""
-    coindex_sep_pos = None
-    gapping_sep_pos = None
-    for i, char in reversed(list(enumerate(label))):
-        if char == DEFAULT_COINDEX_SEPARATOR and coindex_sep_pos == None:
-            coindex_sep_pos = i
-        if char == DEFAULT_GAPPING_SEPARATOR and gapping_sep_pos == None:
-            gapping_sep_pos = i
-    if coindex_sep_pos is not None and label[coindex_sep_pos + 1:].isdigit():
-        coindex = label[coindex_sep_pos + 1:]
-        label = label[:coindex_sep_pos]
-    if gapping_sep_pos is not None and label[gapping_sep_pos + 1:].isdigit() \
-       and coindex == "":
-        gapindex = label[gapping_sep_pos + 1:]
-        label = label[:gapping_sep_pos]
-    # gf
+    match = COINDEX_PATTERN.match(label)
+    if match is not None:
+        label, coindex = match.groups()
+    else:
+        match = GAPINDEX_PATTERN.match(label)
+        if match is not None:
+            label, gapindex = match.groups()
+    # gf: first separator from left to right counts
+    # TODO for TueBa-D/Z this should be right to left
     gf = DEFAULT_EDGE
-    gf_sep_pos = -1
-    for i, char in list(enumerate(label)):
-        # first separator from left to right counts
-        # TODO for TueBa-D/Z this should be right to left
-        if char == gf_separator:
-            gf_sep_pos = i
-            break
-    if gf_sep_pos > 0 and gf_sep_pos < len(label) - 1:
-        gf = label[gf_sep_pos + 1:]
-        label = label[:gf_sep_pos]
-    if len(gf) == 0:
-        gf = DEFAULT_EDGE
+    match = _gf_pattern(gf_separator).match(label)
+    if match is not None:
+        label, gf = match.groups()
     if len(label) == 0:
         label = DEFAULT_LABEL
     # is trace?
     is_trace = len(label) > 0 and label[0] == '*' and label[-1] == '*'
-    lab = Label()
-    lab.label = label
-    lab.gf = gf
-    lab.gf_separator = gf_separator
-    lab.coindex = coindex
-    lab.gapindex = gapindex
-    lab.headmarker = headmarker
-    lab.is_trace = is_trace
-    return lab
+    return Label(label, gf, gf_separator, coindex, gapindex, headmarker,
+                 is_trace)
+
+
+@misc.memoize(16)
+def _gf_pattern(gf_separator):
+    """Pattern which splits a label at the first gf separator, if there is
+    something left and right of it.
+    """
+    return re.compile(r"^([^%s]+)%s(.+)\Z" % (re.escape(gf_separator),
+                                             re.escape(gf_separator)),
+                      re.DOTALL | re.UNICODE)
 
 
 def format_label(label, **params):
     """Glue parts of parsed label (parse_label) together. To delete a certain
-    component of the label, parse_label it, set the corresponding components
-    to the empty string and then format_label it.
-    If param always_label is given, we also write the label if label == trees.
-    DEFAULT_LABEL. Same for gf and DEFAULT_EDGE.
+    component of the label, parse_label it, replace the corresponding
+    components with the empty string (label._replace()) and then format_label
+    it. If param always_label is given, we also write the label if label ==
+    trees.DEFAULT_LABEL. Same for gf and DEFAULT_EDGE. Results are cached (see
+    LABEL_CACHE_SIZE).
+    """
+    return _format_label(label, 'always_label' in params,
+                         'always_gf' in params)
+
+
+@misc.memoize(LABEL_CACHE_SIZE)
+def _format_label(label, label_always, edge_always):
+    """Format a label, see format_label().
     """
-    label_always = 'always_label' in params
-    edge_always = 'always_gf' in params
     if len(label.gapindex) > 0 and len(label.coindex) > 0:
         raise ValueError("Cannot have gapping index and coindex on same label")
     lab = ""